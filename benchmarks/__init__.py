@@ -0,0 +1,6 @@
+"""
+Benchmarks for the Duka One SDK
+
+The benchmarks run against a loopback simulator of the duka devices, so no
+real devices are needed. Run them from the root of the repository.
+"""
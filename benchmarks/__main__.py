@@ -0,0 +1,232 @@
+"""Benchmark suite for the hot paths of the SDK.
+
+Run with: python -m benchmarks --output results.json
+Compare with an earlier run with: python -m benchmarks --compare results.json
+
+The network benchmarks run against the loopback simulator, which is started
+in a separate process listening on 127.0.0.1 port 4000.
+"""
+import argparse
+import json
+import platform
+import statistics
+import threading
+import time
+import timeit
+
+from dukaonesdk.device import Device, Speed
+from dukaonesdk.dukaclient import DukaClient
+from dukaonesdk.dukapacket import DukaPacket
+from dukaonesdk.responsepacket import ResponsePacket
+
+from .simulator import Simulator
+
+DEVICE_ID = "bench00000000000"
+
+
+def _result(times: list, number: int) -> dict:
+    """Return the statistics of a benchmark in seconds per operation"""
+    times = [t / number for t in times]
+    return {
+        "rounds": len(times),
+        "number": number,
+        "mean": statistics.mean(times),
+        "min": min(times),
+        "max": max(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "ops_per_second": 1 / statistics.mean(times),
+    }
+
+
+def _micro(func, number: int = 10000, rounds: int = 7) -> dict:
+    return _result(timeit.repeat(func, number=number, repeat=rounds), number)
+
+
+def _frame(simulator: Simulator, command, *args) -> bytes:
+    """Return the response of the simulator to a command"""
+    request = DukaPacket()
+    command(request, *args)
+    return simulator.handle_request(request.data)[0]
+
+
+def packet_benchmarks() -> dict:
+    """Benchmarks of building and parsing packets"""
+    simulator = Simulator(rpm_jitter=False)
+    device = Device(DEVICE_ID, ip_address="127.0.0.1")
+    status_frame = _frame(simulator, DukaPacket.initialize_status_cmd, device)
+    firmware_frame = _frame(simulator, DukaPacket.initialize_get_firmware_cmd, device)
+    search_frame = _frame(simulator, DukaPacket.initialize_search_cmd)
+
+    def speed_cmd():
+        DukaPacket().initialize_speed_cmd(device, Speed.HIGH)
+
+    def status_cmd():
+        DukaPacket().initialize_status_cmd(device)
+
+    status_packet = DukaPacket()
+    status_packet.initialize_status_cmd(device)
+    status_size = len(status_packet.data) - 2
+
+    def checksum():
+        status_packet.calc_checksum(status_size)
+
+    def parse(frame):
+        return lambda: ResponsePacket().initialize_from_data(frame)
+
+    return {
+        "encode_speed_cmd": _micro(speed_cmd),
+        "encode_status_cmd": _micro(status_cmd),
+        "calc_checksum": _micro(checksum),
+        "parse_status_frame": _micro(parse(status_frame)),
+        "parse_firmware_frame": _micro(parse(firmware_frame)),
+        "parse_search_frame": _micro(parse(search_frame)),
+    }
+
+
+def update_benchmarks(client: DukaClient) -> dict:
+    """Benchmarks of applying a response to a device"""
+    simulator = Simulator(rpm_jitter=False)
+    device = Device(DEVICE_ID, ip_address="127.0.0.1")
+    packets = []
+    for speed in (Speed.LOW, Speed.HIGH):
+        simulator.handle_request(_set_speed_frame(device, speed))
+        packet = ResponsePacket()
+        packet.initialize_from_data(
+            _frame(simulator, DukaPacket.initialize_status_cmd, device)
+        )
+        packets.append(packet)
+    client.update_device(device, "127.0.0.1", packets[0])
+
+    def unchanged():
+        client.update_device(device, "127.0.0.1", packets[0])
+
+    toggle = 0
+
+    def changed():
+        nonlocal toggle
+        toggle ^= 1
+        client.update_device(device, "127.0.0.1", packets[toggle])
+
+    return {
+        "update_device_unchanged": _micro(unchanged),
+        "update_device_changed": _micro(changed),
+    }
+
+
+def _set_speed_frame(device: Device, speed: Speed) -> bytes:
+    packet = DukaPacket()
+    packet.initialize_speed_cmd(device, speed)
+    return packet.data
+
+
+def roundtrip_benchmark(client: DukaClient, rounds: int = 200) -> dict:
+    """Benchmark of a command until the device has been updated with the
+    response"""
+    changed = threading.Event()
+    device = client.add_device(
+        DEVICE_ID, ip_address="127.0.0.1", onchange=lambda device: changed.set()
+    )
+    device.wait_for_initialize()
+    speeds = [Speed.LOW, Speed.HIGH]
+    client.set_speed(device, speeds[0])
+    time.sleep(0.5)
+    times = []
+    for i in range(rounds):
+        speed = speeds[(i + 1) % 2]
+        changed.clear()
+        start = time.perf_counter()
+        client.set_speed(device, speed)
+        while device.speed != speed:
+            if not changed.wait(2):
+                raise Exception("Timeout waiting for the device")
+            changed.clear()
+        times.append(time.perf_counter() - start)
+    client.remove_device(DEVICE_ID)
+    return {"command_roundtrip": _result(times, 1)}
+
+
+def _wait_for_fleet(condition):
+    timeout = time.time() + 10
+    while not condition():
+        if time.time() > timeout:
+            raise Exception("Timeout waiting for the fleet")
+        time.sleep(0.001)
+
+
+def fleet_benchmark(client: DukaClient, devices: int = 200, rounds: int = 5) -> dict:
+    """Benchmark of a status read of every device of a fleet until all the
+    responses have been applied. The fleet is added before the rounds"""
+    device_ids = [f"fleet{i:011d}" for i in range(devices)]
+    fleet = [client.add_device(i, ip_address="127.0.0.1") for i in device_ids]
+    _wait_for_fleet(lambda: all(device.is_initialized() for device in fleet))
+    times = []
+    for _ in range(rounds):
+        sequences = [device.state.sequence for device in fleet]
+        start = time.perf_counter()
+        client.request_status(fleet)
+        # the simulator changes the rpm in every response
+        _wait_for_fleet(
+            lambda: all(
+                device.state.sequence > sequence
+                for device, sequence in zip(fleet, sequences)
+            )
+        )
+        times.append(time.perf_counter() - start)
+    for device_id in device_ids:
+        client.remove_device(device_id)
+    result = _result(times, 1)
+    result["devices"] = devices
+    return {"fleet_poll_cycle": result}
+
+
+def run(devices: int) -> dict:
+    """Run all benchmarks and return the results"""
+    results = packet_benchmarks()
+    simulator = Simulator().start()
+    client = DukaClient(port=0)
+    try:
+        results.update(update_benchmarks(client))
+        results.update(roundtrip_benchmark(client))
+        results.update(fleet_benchmark(client, devices))
+    finally:
+        client.close()
+        simulator.terminate()
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict):
+    """Print the mean time of each benchmark relative to a baseline"""
+    for name, result in report["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            print(f"{name:28} {result['mean'] * 1e6:12.2f} us")
+            continue
+        ratio = result["mean"] / old["mean"]
+        print(f"{name:28} {result['mean'] * 1e6:12.2f} us {ratio:8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="compare with results from this file")
+    parser.add_argument("--devices", type=int, default=200)
+    args = parser.parse_args()
+    report = run(args.devices)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as file:
+            compare(report, json.load(file))
+    elif not args.output:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark of the memory used by the device model.
+
+Run with: python -m benchmarks.memory --devices 10000
+"""
+import argparse
+import json
+import tracemalloc
+
+from dukaonesdk.device import Device
+from dukaonesdk.dukaclient import DukaClient
+from dukaonesdk.dukapacket import DukaPacket
+from dukaonesdk.responsepacket import ResponsePacket
+
+from .simulator import Simulator
+
+
+def run(devices: int) -> dict:
+    """Create the devices, apply a full status to each of them and return
+    the memory used"""
+    simulator = Simulator(autocreate=False, rpm_jitter=False)
+    device_ids = [f"bench{i:011d}" for i in range(devices)]
+    for device_id in device_ids:
+        simulator.add_device(device_id)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fleet = {}
+    for device_id in device_ids:
+        fleet[device_id] = Device(device_id, ip_address="127.0.0.1")
+    created = tracemalloc.get_traced_memory()[0]
+    client = DukaClient(port=0)
+    try:
+        for device in fleet.values():
+            for command in (
+                DukaPacket.initialize_get_firmware_cmd,
+                DukaPacket.initialize_status_cmd,
+            ):
+                request = DukaPacket()
+                command(request, device)
+                packet = ResponsePacket()
+                packet.initialize_from_data(simulator.handle_request(request.data)[0])
+                client.update_device(device, "127.0.0.1", packet)
+    finally:
+        client.close()
+    del request, packet
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    for state in ("speed", "mode", "firmware_version"):
+        if getattr(next(iter(fleet.values())), state) is None:
+            raise Exception("The devices were not updated")
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {
+        "devices": devices,
+        "created_bytes_per_device": round(created / devices, 1),
+        "updated_bytes_per_device": round(total / devices, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=10000)
+    args = parser.parse_args()
+    print(json.dumps(run(args.devices), indent=2))
+
+
+if __name__ == "__main__":
+    main()
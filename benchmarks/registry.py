@@ -0,0 +1,221 @@
+"""Stress test of the device registry with devices added and removed.
+
+Run with: python -m benchmarks.registry --threads 4 --duration 5
+
+The registry part looks up and iterates the devices from several threads
+while other threads add and remove devices, and counts the operations and
+the errors. With --dict the same is done with a plain dict used the way
+the client used it before the registry. The client part polls a simulated
+fleet while threads add, remove and validate devices, and checks that the
+notify thread survives. Run it with a free-threaded build (python3.13t) to
+test without the GIL.
+
+The exit status is 1 if the registry or the client had any errors, or if
+the notify thread died. The errors of the plain dict are only reported.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import sysconfig
+import threading
+import time
+
+from dukaonesdk.device import Device
+from dukaonesdk.dukaclient import DukaClient
+from dukaonesdk.registry import DeviceRegistry
+
+from .simulator import Simulator
+
+
+class _DictRegistry:
+    """A plain dict used like the client used it before the registry"""
+
+    def __init__(self):
+        self._devices = {}
+
+    def view(self) -> dict:
+        return self._devices
+
+    def get(self, device_id: str) -> Device:
+        if device_id not in self._devices:
+            return None
+        return self._devices[device_id]
+
+    def add(self, device: Device) -> Device:
+        self._devices[device.device_id] = device
+        return device
+
+    def remove(self, device_id: str) -> Device:
+        device = self.get(device_id)
+        if device is not None:
+            del self._devices[device_id]
+        return device
+
+
+def _run_threads(targets: list, duration: float) -> list:
+    """Run the targets in threads for duration seconds. Each target gets a
+    stop event and returns (operations, errors)"""
+    stop = threading.Event()
+    results = [None] * len(targets)
+
+    def run(index, target):
+        results[index] = target(stop)
+
+    threads = [
+        threading.Thread(target=run, args=(i, target))
+        for i, target in enumerate(targets)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def registry_stress(
+    registry, devices: int, threads: int, churn: int, duration: float
+) -> dict:
+    """Look up and iterate the devices while devices are added and removed"""
+    device_ids = [f"reg{i:013d}" for i in range(devices)]
+    for device_id in device_ids:
+        registry.add(Device(device_id))
+
+    def lookup(stop):
+        operations = errors = 0
+        rand = random.Random()
+        while not stop.is_set():
+            for _ in range(1000):
+                try:
+                    registry.get(device_ids[rand.randrange(devices)])
+                except Exception:  # pylint: disable=broad-except
+                    errors += 1
+            operations += 1000
+        return operations, errors
+
+    def poll(stop):
+        operations = errors = 0
+        while not stop.is_set():
+            try:
+                for device in registry.view().values():
+                    device.is_initialized()
+                operations += 1
+            except Exception:  # pylint: disable=broad-except
+                errors += 1
+        return operations, errors
+
+    def churn_fn(number):
+        def run(stop):
+            operations = errors = 0
+            i = 0
+            while not stop.is_set():
+                device_id = f"tmp{number:04d}{i % 100:09d}"
+                try:
+                    registry.add(Device(device_id))
+                    registry.remove(device_id)
+                except Exception:  # pylint: disable=broad-except
+                    errors += 1
+                operations += 2
+                i += 1
+            return operations, errors
+
+        return run
+
+    targets = [lookup] * threads + [poll] + [churn_fn(i) for i in range(churn)]
+    results = _run_threads(targets, duration)
+    lookups = results[:threads]
+    polls = results[threads]
+    churns = results[threads + 1 :]
+    return {
+        "registry": type(registry).__name__,
+        "lookups_per_second": round(sum(r[0] for r in lookups) / duration),
+        "polls_per_second": round(polls[0] / duration, 1),
+        "devices_polled_per_second": round(polls[0] * devices / duration),
+        "changes_per_second": round(sum(r[0] for r in churns) / duration),
+        "errors": sum(r[1] for r in results),
+    }
+
+
+def client_stress(devices: int, churn: int, duration: float) -> dict:
+    """Poll a simulated fleet while devices are added, removed and validated"""
+    client = DukaClient(port=0)
+    try:
+        for i in range(devices):
+            client.add_device(f"cli{i:013d}", ip_address="127.0.0.1")
+
+        def churn_fn(number):
+            def run(stop):
+                operations = errors = 0
+                i = 0
+                while not stop.is_set():
+                    device_id = f"chn{number:04d}{i % 100:09d}"
+                    try:
+                        if i % 10 == 0:
+                            client.validate_device(device_id, ip_address="127.0.0.1")
+                        else:
+                            client.add_device(device_id, ip_address="127.0.0.1")
+                            client.remove_device(device_id)
+                    except Exception:  # pylint: disable=broad-except
+                        errors += 1
+                    operations += 1
+                    i += 1
+                return operations, errors
+
+            return run
+
+        start = client.stats()["frames_received"]
+        results = _run_threads([churn_fn(i) for i in range(churn)], duration)
+        frames = client.stats()["frames_received"] - start
+        alive = client._notifythread.is_alive()
+    finally:
+        client.close()
+    return {
+        "devices": devices,
+        "notify_thread_alive": alive,
+        "frames_per_second": round(frames / duration, 1),
+        "changes_per_second": round(sum(r[0] for r in results) / duration, 1),
+        "errors": sum(r[1] for r in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--churn", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument(
+        "--dict", action="store_true", help="also stress a plain dict"
+    )
+    args = parser.parse_args()
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    report = {
+        "python": platform.python_version(),
+        "free_threading": bool(sysconfig.get_config_var("Py_GIL_DISABLED")),
+        "gil_enabled": gil,
+        "results": [],
+    }
+    registries = [DeviceRegistry()] + ([_DictRegistry()] if args.dict else [])
+    for registry in registries:
+        report["results"].append(
+            registry_stress(
+                registry, args.devices, args.threads, args.churn, args.duration
+            )
+        )
+    simulator = Simulator().start()
+    try:
+        client = client_stress(args.devices, args.churn, args.duration)
+    finally:
+        simulator.terminate()
+    report["results"].append(client)
+    print(json.dumps(report, indent=2))
+    registry = report["results"][0]
+    if registry["errors"] or client["errors"] or not client["notify_thread_alive"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
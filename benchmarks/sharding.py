@@ -0,0 +1,109 @@
+"""Benchmark of polling a large fleet with the sharded client.
+
+Run with: python -m benchmarks.sharding --devices 2000 --shards 1,2,4,8
+
+A run fails if any device does not initialize within 30 seconds, or if UDP
+datagrams are dropped because a socket receive buffer is full (read from
+/proc/net/snmp, only on Linux). The rates of a failed run measure the loss,
+not the client, and the exit status is 1.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+from dukaonesdk.device import Device
+from dukaonesdk.shardedclient import ShardedDukaClient
+
+from .simulator import Simulator
+
+
+def _receive_buffer_errors() -> int:
+    """Return the number of UDP datagrams dropped by the kernel because a
+    receive buffer was full. None if it is not known"""
+    try:
+        with open("/proc/net/snmp") as file:
+            lines = [line.split() for line in file if line.startswith("Udp:")]
+    except OSError:
+        return None
+    names, values = lines[0], lines[1]
+    return int(values[names.index("RcvbufErrors")])
+
+
+def run(devices: int, shards: int, duration: float) -> dict:
+    """Poll a simulated fleet and return the number of status updates and
+    frames per second received for the fleet"""
+    updates = 0
+    lock = threading.Lock()
+
+    def onchange(device: Device):
+        nonlocal updates
+        with lock:
+            updates += 1
+
+    dropped = _receive_buffer_errors()
+    client = ShardedDukaClient(shards)
+    try:
+        start = time.perf_counter()
+        fleet = [
+            client.add_device(
+                f"bench{i:011d}", ip_address="127.0.0.1", onchange=onchange
+            )
+            for i in range(devices)
+        ]
+        # wait for the first full poll cycle
+        timeout = time.time() + 30
+        while any(device.mode is None for device in fleet):
+            if time.time() > timeout:
+                break
+            time.sleep(0.1)
+        initialize_seconds = time.perf_counter() - start
+        initialized = sum(device.mode is not None for device in fleet)
+        with lock:
+            updates = 0
+        frames = client.stats()["frames_received"]
+        start = time.perf_counter()
+        time.sleep(duration)
+        with lock:
+            elapsed = time.perf_counter() - start
+            rate = updates / elapsed
+        frame_rate = (client.stats()["frames_received"] - frames) / elapsed
+    finally:
+        client.close()
+    if dropped is not None:
+        dropped = _receive_buffer_errors() - dropped
+    return {
+        "devices": devices,
+        "shards": shards,
+        "initialized": initialized,
+        "initialize_seconds": round(initialize_seconds, 2),
+        "dropped": dropped,
+        "failed": initialized < devices or bool(dropped),
+        "frames_per_second": round(frame_rate, 1),
+        "updates_per_second": round(rate, 1),
+        "updates_per_device_per_second": round(rate / devices, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--shards", default="1,2,4,8")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+    simulator = Simulator(humidity_jitter=True).start()
+    try:
+        results = [
+            run(args.devices, int(shards), args.duration)
+            for shards in args.shards.split(",")
+        ]
+    finally:
+        simulator.terminate()
+    print(json.dumps(results, indent=2))
+    if any(result["failed"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""Implements a loopback simulator of the duka one devices"""
+import datetime
+import multiprocessing
+import random
+import socket
+
+from dukaonesdk.dukapacket import DukaPacket
+from dukaonesdk.responsepacket import ResponsePacket
+
+
+class SimulatedDevice:
+    """The registers of a single simulated device"""
+
+    def __init__(self, device_id: str, password: str = "1111"):
+        self.device_id = device_id
+        self.password = password
+        self.registers = {
+            0x01: bytes([1]),  # On
+            0x02: bytes([1]),  # Speed low
+            0x25: bytes([45]),  # Humidity
+            0x44: bytes([128]),  # Manual speed
+            0x4A: (1200).to_bytes(2, "little"),  # Fan 1 rpm
+            0x64: bytes([0, 0, 90]),  # Filter timer 90 days
+            0x86: bytes([1, 2, 17, 3]) + (2020).to_bytes(2, "little"),
+            0x88: bytes([0]),  # Filter alarm
+            0xB7: bytes([1]),  # Heat recovery
+            0xB9: bytes([3, 0]),  # Unit type
+            0x72: bytes([0]),  # Weekly schedule off
+        }
+        # schedule setup by (day, period): speed 1 until 00:00
+        self.schedule = {
+            (day, period): bytes([day, period, 1, 0, 0, 0])
+            for day in range(7)
+            for period in range(1, 5)
+        }
+        # the real time clock is the local time plus an offset
+        self.clock_offset = datetime.timedelta()
+        # a clock that is not set reads as zeros, like after battery loss
+        self.clock_set = True
+
+    def read(self, parameter: int, argument: bytes) -> bytes:
+        """Return the value of a parameter"""
+        if parameter == 0x77:
+            return self.schedule.get((argument[0], argument[1]))
+        if parameter in (0x6F, 0x70):
+            if not self.clock_set:
+                return bytes(3 if parameter == 0x6F else 4)
+            now = datetime.datetime.now() + self.clock_offset
+            if parameter == 0x6F:
+                return bytes([now.second, now.minute, now.hour])
+            return bytes([now.day, now.isoweekday(), now.month, now.year - 2000])
+        return self.registers.get(parameter)
+
+    def write(self, parameter: int, value: bytes):
+        """Set the value of a parameter"""
+        if parameter == 0x77:
+            self.schedule[(value[0], value[1])] = value
+        elif parameter in (0x6F, 0x70):
+            if not self.clock_set:
+                self.clock_set = True
+                self.clock_offset = datetime.timedelta()
+            now = datetime.datetime.now()
+            clock = now + self.clock_offset
+            if parameter == 0x6F:
+                clock = clock.replace(hour=value[2], minute=value[1], second=value[0])
+            else:
+                clock = clock.replace(
+                    year=2000 + value[3], month=value[2], day=value[0]
+                )
+            self.clock_offset = clock - now
+        elif parameter in self.registers:
+            current = self.registers[parameter]
+            self.registers[parameter] = value + current[len(value) :]
+
+
+class Simulator:
+    """Answers duka requests on a UDP socket like a fleet of devices.
+
+    Unknown device ids are created on the fly when autocreate is True.
+    With rpm_jitter and humidity_jitter the values change a little in each
+    response, like an idle fan does. With rpm_jitter the rpm is different in
+    every response.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 4000,
+        autocreate: bool = True,
+        rpm_jitter: bool = True,
+        humidity_jitter: bool = False,
+    ):
+        self._host = host
+        self._port = port
+        self._autocreate = autocreate
+        self._rpm_jitter = rpm_jitter
+        self._humidity_jitter = humidity_jitter
+        self._devices = {}
+
+    def add_device(self, device_id: str, password: str = "1111") -> SimulatedDevice:
+        """Add a simulated device"""
+        device = SimulatedDevice(device_id, password)
+        self._devices[device_id] = device
+        return device
+
+    def serve_forever(self, ready=None):
+        """Answer requests until the process is terminated"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        sock.bind((self._host, self._port))
+        if ready is not None:
+            ready.set()
+        while True:
+            data, addr = sock.recvfrom(1024)
+            for response in self.handle_request(data):
+                sock.sendto(response, addr)
+
+    def start(self) -> multiprocessing.Process:
+        """Start the simulator in a separate process and wait for it to
+        listen. Call terminate on the returned process to stop it."""
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(
+            target=self.serve_forever, args=(ready,), daemon=True
+        )
+        process.start()
+        if not ready.wait(5):
+            process.terminate()
+            raise Exception("Timeout waiting for the simulator")
+        return process
+
+    def handle_request(self, data) -> list:
+        """Handle a request and return the response frames.
+        Returns an empty list if the device should not respond
+        """
+        size = len(data)
+        if size < 6 or data[0] != 0xFD or data[1] != 0xFD or data[2] != 0x02:
+            return []
+        if sum(data[2 : size - 2]) & 0xFFFF != data[size - 2] + (data[size - 1] << 8):
+            return []
+        pos = 3
+        device_id = data[pos + 1 : pos + 1 + data[pos]].decode()
+        pos += 1 + data[pos]
+        password = data[pos + 1 : pos + 1 + data[pos]].decode()
+        pos += 1 + data[pos]
+        func = data[pos]
+        pos += 1
+        if device_id == "DEFAULT_DEVICEID":
+            return self.__search_responses()
+        device = self._devices.get(device_id)
+        if device is None and self._autocreate:
+            device = self.add_device(device_id, password)
+        if device is None or password != device.password:
+            return []
+        if func == DukaPacket.Func.READ.value:
+            parameters = self.__read_request(data, pos, size - 2)
+        elif func in (DukaPacket.Func.WRITE.value, DukaPacket.Func.WRITEREAD.value):
+            parameters = self.__write_request(device, data, pos, size - 2)
+            if func == DukaPacket.Func.WRITE.value:
+                return []
+        else:
+            return []
+        return [self.__response(device, parameters)]
+
+    def __read_request(self, data, pos: int, end: int) -> list:
+        """Return the (parameter, argument) requested by a read request"""
+        parameters = []
+        while pos < end:
+            if data[pos] == 0xFE:
+                size = data[pos + 1]
+                argument = bytes(data[pos + 3 : pos + 3 + size])
+                parameters.append((data[pos + 2], argument))
+                pos += 3 + size
+                continue
+            parameters.append((data[pos], b""))
+            pos += 1
+        return parameters
+
+    def __write_request(self, device: SimulatedDevice, data, pos: int, end: int):
+        """Apply the values of a write request and return the parameters"""
+        parameters = []
+        while pos < end:
+            parameter = data[pos]
+            size = ResponsePacket.parameter_size.get(parameter, 1)
+            if parameter == 0xFE:
+                size = data[pos + 1]
+                parameter = data[pos + 2]
+                pos += 2
+            pos += 1
+            value = bytes(data[pos : pos + size])
+            pos += size
+            device.write(parameter, value)
+            parameters.append((parameter, value))
+        return parameters
+
+    def __response(self, device: SimulatedDevice, parameters: list) -> bytes:
+        """Build a response frame for the requested parameters"""
+        if self._rpm_jitter:
+            # a new rpm in every response, so every response changes the state
+            current = int.from_bytes(device.registers[0x4A], "little")
+            rpm = current
+            while rpm == current:
+                rpm = 1200 + random.randint(-15, 15)
+            device.registers[0x4A] = rpm.to_bytes(2, "little")
+        if self._humidity_jitter:
+            device.registers[0x25] = bytes([random.randint(40, 60)])
+        data = bytearray([0xFD, 0xFD, 0x02])
+        self.__add_string(data, device.device_id)
+        self.__add_string(data, device.password)
+        data.append(DukaPacket.Func.RESPONSE.value)
+        for parameter, argument in parameters:
+            value = device.read(parameter, argument)
+            if value is None:
+                # like the devices, answer that the parameter is not supported
+                data += bytes([0xFD, parameter])
+                continue
+            if len(value) != ResponsePacket.parameter_size.get(parameter):
+                data += bytes([0xFE, len(value)])
+            data.append(parameter)
+            data += value
+        return self.__add_checksum(data)
+
+    def __search_responses(self) -> list:
+        """Build the responses to a search for devices"""
+        responses = []
+        for device in self._devices.values():
+            data = bytearray([0xFD, 0xFD, 0x02])
+            self.__add_string(data, device.device_id)
+            self.__add_string(data, "")
+            data.append(DukaPacket.Func.RESPONSE.value)
+            data.append(DukaPacket.Parameters.SEARCH.value)
+            data += device.device_id.encode()
+            responses.append(self.__add_checksum(data))
+        return responses
+
+    def __add_string(self, data: bytearray, txt: str):
+        data.append(len(txt))
+        data += txt.encode()
+
+    def __add_checksum(self, data: bytearray) -> bytes:
+        checksum = sum(data[2:]) & 0xFFFF
+        data.append(checksum & 0xFF)
+        data.append(checksum >> 8)
+        return bytes(data)
@@ -0,0 +1,108 @@
+"""Implements the capabilities of the different duka one unit types"""
+from typing import NamedTuple
+
+from .mode import Mode
+from .speed import Speed
+
+
+class UnsupportedCommandError(Exception):
+    """Raised when a command is not supported by the device"""
+
+
+class Capabilities(NamedTuple):
+    """The parameters and values supported by a unit type"""
+
+    parameters: frozenset
+    speeds: frozenset = frozenset(Speed) - {Speed.OFF}
+    modes: frozenset = frozenset(Mode)
+    manualspeed_range: tuple = (0, 255)
+
+    def supports(self, parameter: int) -> bool:
+        """Return True if the parameter is supported"""
+        return parameter in self.parameters
+
+    def check(self, device_id: str, parameter: int, value: int = None):
+        """Check that a parameter and value can be written to the device.
+        Raises UnsupportedCommandError if the parameter is not supported and
+        ValueError if the value is not valid"""
+        if parameter not in self.parameters:
+            raise UnsupportedCommandError(
+                f"Parameter 0x{parameter:02X} is not supported by device {device_id}"
+            )
+        if value is None:
+            return
+        if parameter == 0x02:
+            valid = value in self.speeds
+        elif parameter == 0xB7:
+            valid = value in self.modes
+        elif parameter == 0x44:
+            valid = self.manualspeed_range[0] <= value <= self.manualspeed_range[1]
+        else:
+            valid = 0 <= value <= 255
+        if not valid:
+            raise ValueError(
+                f"Invalid value {value} for parameter 0x{parameter:02X} "
+                f"of device {device_id}"
+            )
+
+    def without(self, parameters) -> "Capabilities":
+        """Return the capabilities without the parameters"""
+        return self._replace(parameters=self.parameters.difference(parameters))
+
+
+# The parameters the client reads and writes. Other parameters are rejected
+# by write_parameters unless capabilities with them are registered
+DEFAULT_CAPABILITIES = Capabilities(
+    parameters=frozenset(
+        (
+            0x01,  # On off
+            0x02,  # Speed
+            0x25,  # Current humidity
+            0x44,  # Manual speed
+            0x4A,  # Fan 1 speed
+            0x64,  # Filter timer
+            0x65,  # Reset filter timer
+            0x6F,  # RTC time
+            0x70,  # RTC calendar
+            0x72,  # Weekly schedule
+            0x77,  # Schedule setup
+            0x88,  # Filter replacement
+            0xB7,  # Ventilation mode
+        )
+    )
+)
+
+# The capabilities by unit type, as a list of (minimum firmware version,
+# capabilities) sorted by firmware version. Add to it with
+# register_capabilities. No differences between the models are known yet,
+# so it is empty and all devices start with the default capabilities;
+# parameters a device reports as unsupported are removed at runtime.
+CAPABILITY_TABLE = {}
+
+
+def _version(firmware_version: str) -> tuple:
+    """Return a firmware version like "1.2" as a tuple that can be compared"""
+    try:
+        return tuple(int(part) for part in firmware_version.split("."))
+    except (AttributeError, ValueError):
+        return (0, 0)
+
+
+def register_capabilities(
+    unit_type: int, min_firmware_version: str, capabilities: Capabilities
+):
+    """Add the capabilities of a unit type from a firmware version"""
+    entries = CAPABILITY_TABLE.setdefault(unit_type, [])
+    entries.append((_version(min_firmware_version), capabilities))
+    entries.sort(key=lambda entry: entry[0])
+
+
+def get_capabilities(unit_type: int, firmware_version: str) -> Capabilities:
+    """Return the capabilities of a unit type with a firmware version.
+    Returns the default capabilities for unknown unit types"""
+    version = _version(firmware_version)
+    capabilities = DEFAULT_CAPABILITIES
+    for min_version, entry in CAPABILITY_TABLE.get(unit_type, []):
+        if min_version <= version:
+            capabilities = entry
+    return capabilities
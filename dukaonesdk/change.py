@@ -0,0 +1,21 @@
+from enum import IntFlag
+
+
+class Change(IntFlag):
+    """The fields of a device that have changed in an update"""
+
+    NONE = 0
+    IP_ADDRESS = 0x001
+    SPEED = 0x002
+    MANUALSPEED = 0x004
+    MODE = 0x008
+    FILTER_ALARM = 0x010
+    FILTER_TIMER = 0x020
+    HUMIDITY = 0x040
+    FAN1RPM = 0x080
+    FIRMWARE_VERSION = 0x100
+    FIRMWARE_DATE = 0x200
+    UNIT_TYPE = 0x400
+    # The changes that trigger the onchange event of a device
+    NOTIFY = 0x07F
+    ALL = 0x7FF
@@ -1,12 +1,147 @@
 """Implements the duka one device class """
+import datetime
 import time
+from typing import NamedTuple
+
+from .capabilities import DEFAULT_CAPABILITIES, Capabilities
+from .change import Change
 from .mode import Mode
+from .schedule import Schedule
 from .speed import Speed
 
 
+class DeviceState(NamedTuple):
+    """An immutable snapshot of the state of a device.
+
+    A new snapshot with a higher sequence number replaces the old one each
+    time the device is updated, so all values in a snapshot are consistent.
+    """
+
+    sequence: int = 0
+    ip_address: str = "<broadcast>"
+    speed: Speed = None
+    manualspeed: int = None
+    fan1rpm: int = None
+    mode: Mode = None
+    filter_alarm: bool = False
+    filter_timer: int = None
+    humidity: int = None
+    firmware_version: str = None
+    firmware_date: str = None
+    unit_type: int = None
+
+
+# The state fields updated from the response packets and their change flags
+PACKET_FIELDS = (
+    ("speed", Change.SPEED),
+    ("manualspeed", Change.MANUALSPEED),
+    ("mode", Change.MODE),
+    ("filter_alarm", Change.FILTER_ALARM),
+    ("filter_timer", Change.FILTER_TIMER),
+    ("humidity", Change.HUMIDITY),
+    ("fan1rpm", Change.FAN1RPM),
+    ("firmware_version", Change.FIRMWARE_VERSION),
+    ("firmware_date", Change.FIRMWARE_DATE),
+    ("unit_type", Change.UNIT_TYPE),
+)
+_STATE_FIELDS = (("ip_address", Change.IP_ADDRESS),) + PACKET_FIELDS
+_NOTIFY = Change.NOTIFY.value
+# The continuous fields a listener threshold applies to. Other fields always
+# notify when they change
+_THRESHOLD_FIELDS = (
+    ("manualspeed", Change.MANUALSPEED),
+    ("filter_timer", Change.FILTER_TIMER),
+    ("humidity", Change.HUMIDITY),
+    ("fan1rpm", Change.FAN1RPM),
+)
+# The clock of a device with an invalid date or time, e.g. after the clock
+# battery has run out
+INVALID_CLOCK = datetime.datetime.min
+
+
+def changed_fields(old: DeviceState, new: DeviceState) -> Change:
+    """Return the fields that differ between two states"""
+    changes = 0
+    for name, flag in _STATE_FIELDS:
+        if getattr(old, name) != getattr(new, name):
+            changes |= flag
+    return Change(changes)
+
+
+class DeviceListener:
+    """A listener for changes of some of the fields of a device.
+
+    With a threshold, the manual speed, filter timer, humidity and fan1rpm
+    must have changed at least threshold since the value the listener was
+    last called with, e.g. a humidity change of 3 or more. Changes of the
+    other fields are always notified.
+    """
+
+    __slots__ = ("callback", "changes", "threshold", "_notified")
+
+    def __init__(
+        self, callback, changes: Change, threshold: float, state: DeviceState
+    ):
+        self.callback = callback
+        self.changes = changes
+        self.threshold = threshold
+        self._notified = state
+
+    def notify(self, device, changes: Change):
+        """Call the callback if the changes match the listener"""
+        changes &= self.changes
+        if not changes:
+            return
+        state = device.state
+        if self.threshold is not None:
+            changes = self.__above_threshold(state, changes)
+            if not changes:
+                return
+            # fields not notified are still compared with the old values
+            notified = {
+                name: getattr(state, name)
+                for name, flag in _THRESHOLD_FIELDS
+                if changes & flag
+            }
+            self._notified = self._notified._replace(**notified)
+        self.callback(device, changes)
+
+    def __above_threshold(self, state: DeviceState, changes: Change) -> Change:
+        """Return the changes that are not threshold fields, or that are at
+        least threshold from the values the listener was last called with"""
+        result = changes.value
+        for name, flag in _THRESHOLD_FIELDS:
+            if not changes & flag:
+                continue
+            old = getattr(self._notified, name)
+            new = getattr(state, name)
+            if old is None or new is None:
+                continue
+            if abs(new - old) < self.threshold:
+                result &= ~flag
+        return Change(result)
+
+
 class Device:
     """A class representing a single Duke One Device"""
 
+    __slots__ = (
+        "_id",
+        "_password",
+        "_changeevent",
+        "_state",
+        "_listeners",
+        "_poll_intervals",
+        "_poll_due",
+        "_schedule",
+        "_weekly_schedule",
+        "_rtc",
+        "_last_seen",
+        "_seen",
+        "_capabilities",
+        "_last_frame",
+    )
+
     def __init__(
         self,
         deviceid: str,
@@ -16,18 +151,19 @@ class Device:
     ):
         self._id = deviceid
         self._password = password
-        self._ip_address = ip_address
-        self._speed: Speed = None
-        self._mode: Mode = None
-        self._manualspeed: int = None
-        self._fan1rpm: int = None
-        self._humidity: int = None
-        self._filter_alarm = False
-        self._filter_timer = None
         self._changeevent = onchange
-        self._firmware_version = None
-        self._firmware_date = None
-        self._unit_type = None
+        self._state = DeviceState(ip_address=ip_address)
+        self._listeners = ()
+        self._poll_intervals = {}
+        self._poll_due = {}
+        self._schedule = {}
+        self._weekly_schedule = None
+        self._rtc = None
+        self._last_seen = None
+        # the time of the last response by the fields it had
+        self._seen = {}
+        self._capabilities = DEFAULT_CAPABILITIES
+        self._last_frame = None
 
     @property
     def device_id(self) -> str:
@@ -41,59 +177,152 @@ class Device:
             return self._password
         return "1111"
 
+    @property
+    def state(self) -> DeviceState:
+        """Return a consistent snapshot of the state of the device"""
+        return self._state
+
+    @property
+    def poll_intervals(self) -> dict:
+        """Return the poll intervals in seconds by parameter, that differs
+        from the default poll interval"""
+        return self._poll_intervals
+
     @property
     def ip_address(self) -> str:
         """Return the IP of the device"""
-        return self._ip_address
+        return self._state.ip_address
 
     @property
     def speed(self) -> Speed:
         """Return the speed of the device"""
-        return self._speed
+        return self._state.speed
 
     @property
     def manualspeed(self) -> int:
         """Return the manual speed of the device"""
-        return self._manualspeed
+        return self._state.manualspeed
 
     @property
     def fan1rpm(self) -> int:
         """Return the fan1 rpm of the device"""
-        return self._fan1rpm
+        return self._state.fan1rpm
 
     @property
     def mode(self) -> Mode:
         """Return the mode of the device"""
-        return self._mode
+        return self._state.mode
 
     @property
     def filter_alarm(self) -> bool:
         """Return the filter alarm of the device"""
-        return self._filter_alarm
+        return self._state.filter_alarm
 
     @property
     def filter_timer(self) -> int:
         """Return the filter timer in minutes"""
-        return self._filter_timer
+        return self._state.filter_timer
 
     @property
     def humidity(self) -> int:
         """Return the humidity."""
-        return self._humidity
+        return self._state.humidity
 
     @property
     def firmware_version(self) -> str:
         """Return the firmware version of the duka one device"""
-        return self._firmware_version
+        return self._state.firmware_version
 
     @property
     def firmware_date(self) -> str:
         """return the firmware date"""
-        return self._firmware_date
+        return self._state.firmware_date
 
     @property
     def unit_type(self) -> int:
-        return self._unit_type
+        return self._state.unit_type
+
+    @property
+    def capabilities(self) -> Capabilities:
+        """Return the parameters and values supported by the device.
+        These are the default capabilities, unless others are registered for
+        the unit type and firmware version, without the parameters the
+        device has answered it does not support"""
+        return self._capabilities
+
+    @property
+    def last_seen(self) -> float:
+        """Return the time.monotonic() time of the last response from the
+        device. None if the device has not responded"""
+        return self._last_seen
+
+    def fields_seen(self, fields: Change) -> float:
+        """Return the time.monotonic() time the oldest of the fields was last
+        received from the device. Unlike last_seen this is not changed by
+        responses without the fields, like the polls of only the fan rpm.
+        None if a field has not been received"""
+        seen = self._seen
+        oldest = None
+        for _, flag in PACKET_FIELDS:
+            if not fields & flag:
+                continue
+            latest = None
+            for mask, received in seen.items():
+                if mask & flag and (latest is None or received > latest):
+                    latest = received
+            if latest is None:
+                return None
+            if oldest is None or latest < oldest:
+                oldest = latest
+        return oldest
+
+    @property
+    def schedule(self) -> Schedule:
+        """Return the periods of the weekly schedule that have been read"""
+        return Schedule(self._schedule.values())
+
+    @property
+    def weekly_schedule(self) -> bool:
+        """Return True if the weekly schedule is turned on"""
+        return self._weekly_schedule
+
+    @property
+    def rtc(self) -> datetime.datetime:
+        """Return the current time of the real time clock of the device,
+        based on when it was last read. None if it has not been read, and
+        INVALID_CLOCK if the clock of the device is not set"""
+        rtc = self._rtc
+        if rtc is None:
+            return None
+        clock, received = rtc
+        if clock is INVALID_CLOCK:
+            return INVALID_CLOCK
+        return clock + datetime.timedelta(seconds=time.monotonic() - received)
+
+    def add_listener(
+        self, callback, changes: Change = Change.ALL, threshold: float = None
+    ) -> DeviceListener:
+        """Add a listener called as callback(device, changes) when any of the
+        specified fields change. Unlike onchange this can be used for fields
+        like fan1rpm. Returns the listener to use with remove_listener.
+        """
+        listener = DeviceListener(callback, changes, threshold, self._state)
+        self._listeners = self._listeners + (listener,)
+        return listener
+
+    def remove_listener(self, listener: DeviceListener):
+        """Remove a listener added with add_listener"""
+        self._listeners = tuple(
+            item for item in self._listeners if item is not listener
+        )
+
+    def notify_change(self, changes: Change):
+        """Call the onchange callback and the listeners matching the changes.
+        Called by the dukaclient"""
+        if self._changeevent is not None and changes.value & _NOTIFY:
+            self._changeevent(self)
+        for listener in self._listeners:
+            listener.notify(self, changes)
 
     def is_initialized(self):
         """Returns True if the device has initilized.
@@ -1,22 +1,106 @@
 """Implements a client for making a udp connection to the duka one devices """
+import datetime
 import socket
 import threading
 import time
+from typing import NamedTuple
 
-from socket import SOL_SOCKET, SO_REUSEADDR, SO_BROADCAST
+from socket import SOL_SOCKET, SO_REUSEADDR, SO_BROADCAST, SO_RCVBUF
 
-from .device import Device, Mode, Speed
+from .capabilities import get_capabilities
+from .change import Change
+from .device import INVALID_CLOCK, PACKET_FIELDS, Device, DeviceState, Mode, Speed
 from .dukapacket import DukaPacket
+from .journal import Journal
+from .registry import DeviceRegistry
 from .responsepacket import ResponsePacket
+from .schedule import Schedule
+from .tracing import Tracer
+
+# The packet fields with plain int flags, which are faster to combine
+_PACKET_FIELDS = tuple((name, int(flag)) for name, flag in PACKET_FIELDS)
+# The changes that may change the capabilities of the device
+_TYPE_CHANGES = Change.FIRMWARE_VERSION.value | Change.UNIT_TYPE.value
+# Cache of the Change flags by int value, as creating them is slow
+_CHANGES = {0: Change.NONE}
+
+# The default number of seconds between reading a status parameter
+DEFAULT_POLL_INTERVAL = 1.0
+# Parameters due to be read within this number of seconds are read together
+_POLL_MERGE_WINDOW = 0.1
+# The number of status read frames sent in a burst, and the number of
+# seconds between the bursts, so the responses of a large fleet do not
+# overflow the socket receive buffer
+_POLL_BURST = 64
+_POLL_PACE = 0.01
+# The size of the socket receive buffer. Linux caps it at net.core.rmem_max
+_RECEIVE_BUFFER_SIZE = 1 << 21
+# The number of schedule periods read or written in one frame
+_SCHEDULE_BATCH = 8
+# The status parameters with a poll interval. On/off is read with the speed
+_POLL_PARAMETERS = tuple(
+    parameter
+    for parameter in DukaPacket.status_parameters
+    if parameter != DukaPacket.Parameters.ON_OFF.value
+)
+# The number of seconds between the bursts of validation probes
+_PROBE_PACE = 0.01
+# The parameters read by a validation probe
+_PROBE_PARAMETERS = DukaPacket.status_parameters + (
+    DukaPacket.Parameters.READ_FIRMWARE_VERSION.value,
+    DukaPacket.Parameters.UNIT_TYPE.value,
+)
+
+
+class ValidationResult(NamedTuple):
+    """The result of validating a device"""
+
+    device_id: str
+    found: bool
+    reason: str = None
+    ip_address: str = None
+    rtt: float = None
+    firmware_version: str = None
+    unit_type: int = None
+
+
+class _Probe:
+    """A validation probe waiting for the response from a device"""
+
+    __slots__ = ("device", "sent", "received", "address", "packet")
+
+    def __init__(self, device: Device):
+        self.device = device
+        self.sent = None
+        self.received = None
+        self.address = None
+        self.packet = None
 
 
 class DukaClient:
-    """Client object for making connection to the duka devices."""
-
-    _mutex = threading.Lock()
-
-    def __init__(self):
-        self._devices = {}
+    """Client object for making connection to the duka devices.
+
+    The client binds to UDP port 4000 by default. Use port 0 to bind to an
+    ephemeral port; the devices reply to the source port of the request.
+    Pass a Tracer to record the stages of the commands sent to the devices,
+    and a Journal to record the state changes of the devices.
+    """
+
+    def __init__(
+        self, port: int = 4000, tracer: Tracer = None, journal: Journal = None
+    ):
+        self._port = port
+        self._tracer = tracer
+        self._journal = journal
+        self._mutex = threading.Lock()
+        self._devices = DeviceRegistry()
+        self._next_poll = 0
+        self._sweep = []
+        self._sweep_next = 0
+        self._frames_received = 0
+        self._frames_identical = 0
+        self._frames_rpm_only = 0
+        self._probes = {}
         self._sock = None
         self._socket_listening = False
 
@@ -42,8 +126,9 @@ class DukaClient:
         be returned"""
         device: Device = self.get_device(device_id)
         if device is None:
-            device = Device(device_id, password, ip_address, onchange)
-            self._devices[device_id] = device
+            device = self._devices.add(
+                Device(device_id, password, ip_address, onchange)
+            )
         packet = DukaPacket()
         packet.initialize_get_firmware_cmd(device)
         self.__send_data(device, packet.data)
@@ -51,87 +136,282 @@ class DukaClient:
 
     def remove_device(self, device_id):
         """Remove an existing device"""
-        device: Device = self.get_device(device_id)
-        if device is not None:
-            del self._devices[device_id]
-        return device
+        return self._devices.remove(device_id)
 
     def get_device(self, device_id: str) -> Device:
         """Get a device by device id."""
-        if device_id not in self._devices:
-            return None
-        return self._devices[device_id]
+        return self._devices.get(device_id)
 
     def get_device_count(self):
         """Return the number of devices"""
         return len(self._devices)
 
+    def snapshot(self) -> dict:
+        """Return the current state of every device by device id.
+        The states are immutable, so they are not copied"""
+        return {
+            device_id: device.state
+            for device_id, device in self._devices.view().items()
+        }
+
+    def stats(self) -> dict:
+        """Return counters of the frames received from the devices.
+        Frames identical to the last frame from the device, or differing only
+        in the fan rpm, are applied without decoding them. The hit rate is
+        the share of the frames applied that way"""
+        received = self._frames_received
+        identical = self._frames_identical
+        rpm_only = self._frames_rpm_only
+        return {
+            "frames_received": received,
+            "frames_identical": identical,
+            "frames_rpm_only": rpm_only,
+            "hit_rate": (identical + rpm_only) / received if received else 0.0,
+        }
+
+    def set_poll_interval(self, device: Device, parameter: int, seconds: float):
+        """Set the number of seconds between reading a status parameter of the
+        device, e.g. DukaPacket.Parameters.FAN1RPM. Use None to stop reading
+        the parameter. The on/off state is always read with the speed.
+        Parameters that are due at the same time are read in one frame.
+        The interval must be at least 0.1 seconds, the time parameters due
+        together are merged within.
+        """
+        parameter = int(getattr(parameter, "value", parameter))
+        if parameter not in _POLL_PARAMETERS:
+            raise ValueError(f"Parameter 0x{parameter:02X} is not a status parameter")
+        if seconds is not None and not seconds >= _POLL_MERGE_WINDOW:
+            raise ValueError(
+                f"Poll interval {seconds} is less than {_POLL_MERGE_WINDOW} seconds"
+            )
+        intervals = dict(device._poll_intervals)
+        if seconds == DEFAULT_POLL_INTERVAL:
+            intervals.pop(parameter, None)
+        else:
+            intervals[parameter] = seconds
+        device._poll_intervals = intervals
+        # read with the new interval from now
+        device._poll_due = {}
+        self._sweep_next = 0
+        self._next_poll = 0
+
+    def request_status(self, devices: list):
+        """Send a status read to the devices now, without waiting for the
+        poll interval. The devices are updated when the responses arrive"""
+        for device in devices:
+            packet = DukaPacket()
+            packet.initialize_status_cmd(device)
+            self.__send_data(device, packet.data)
+
     def search_devices(self, callback):
         self._found_device_callback = callback
         packet = DukaPacket()
         packet.initialize_search_cmd()
         self.__wait_for_socket()
-        with DukaClient._mutex:
+        with self._mutex:
             self._sock.sendto(packet.data, ("<broadcast>", 4000))
 
     def set_speed(self, device: Device, speed: Speed):
         """Set the speed of the specified device"""
-        if device.speed == speed:
-            return
         if speed == Speed.OFF:
             self.turn_off(device)
             return
+        parameter = DukaPacket.Parameters.SPEED.value
+        device.capabilities.check(device.device_id, parameter, speed)
+        if device.speed == speed:
+            return
+        self.__begin_command(device, parameter, "set_speed", speed)
         if device.speed == Speed.OFF:
             self.turn_on(device)
-            time.sleep(0.2)
+            self.__sleep(device, 0.2)
 
         packet = DukaPacket()
         packet.initialize_speed_cmd(device, speed)
         data = packet.data
-        self.__send_data(device, data)
+        self.__send_data(device, data, parameter)
 
     def set_manual_speed(self, device: Device, manualspeed: int):
         """Set the manual speed of the specified device"""
+        parameter = DukaPacket.Parameters.MANUAL_SPEED.value
+        device.capabilities.check(device.device_id, parameter, manualspeed)
+        self.__begin_command(device, parameter, "set_manual_speed", manualspeed)
         if device.speed != Speed.MANUAL:
             self.set_speed(device, Speed.MANUAL)
-            time.sleep(0.2)
+            self.__sleep(device, 0.2)
 
         packet = DukaPacket()
         packet.initialize_manualspeed_cmd(device, manualspeed)
         data = packet.data
-        self.__send_data(device, data)
+        self.__send_data(device, data, parameter)
 
     def turn_off(self, device: Device):
         """Turn off the specified device"""
+        parameter = DukaPacket.Parameters.ON_OFF.value
+        device.capabilities.check(device.device_id, parameter)
         if device.speed == Speed.OFF:
             return
+        self.__begin_command(device, parameter, "turn_off", False)
         packet = DukaPacket()
         packet.initialize_off_cmd(device)
         data = packet.data
-        self.__send_data(device, data)
+        self.__send_data(device, data, parameter)
 
     def turn_on(self, device: Device):
         """Turn on the specified device"""
+        parameter = DukaPacket.Parameters.ON_OFF.value
+        device.capabilities.check(device.device_id, parameter)
         if device.speed != Speed.OFF:
             return
+        self.__begin_command(device, parameter, "turn_on", True)
         packet = DukaPacket()
         packet.initialize_on_cmd(device)
         data = packet.data
-        self.__send_data(device, data)
+        self.__send_data(device, data, parameter)
 
     def set_mode(self, device: Device, mode: Mode):
         """Set the mode of the specified device"""
+        parameter = DukaPacket.Parameters.VENTILATION_MODE.value
+        device.capabilities.check(device.device_id, parameter, mode)
         if device.mode == Mode:
             return
+        self.__begin_command(device, parameter, "set_mode", mode)
         packet = DukaPacket()
         packet.initialize_mode_cmd(device, mode)
         data = packet.data
-        self.__send_data(device, data)
+        self.__send_data(device, data, parameter)
 
     def reset_filter_alarm(self, device: Device):
         """Reset the filter alarm"""
+        parameter = DukaPacket.Parameters.RESET_FILTER_TIMER.value
+        device.capabilities.check(device.device_id, parameter)
+        self.__begin_command(device, parameter, "reset_filter_alarm")
         packet = DukaPacket()
         packet.initialize_reset_filter_alarm_cmd(device)
+        # the device does not respond to a write command
+        self.__send_data(device, packet.data, parameter, final=True)
+
+    def set_weekly_schedule(self, device: Device, enabled: bool):
+        """Turn the weekly schedule of the device on or off"""
+        device.capabilities.check(
+            device.device_id, DukaPacket.Parameters.WEEKLY_SCHEDULE.value
+        )
+        packet = DukaPacket()
+        packet.initialize_weekly_schedule_cmd(device, enabled)
+        self.__send_data(device, packet.data)
+
+    def read_schedule(self, device: Device, timeout: float = 4) -> Schedule:
+        """Read the weekly schedule of the device.
+        Returns None if the device does not respond"""
+        return self.read_schedules([device], timeout).get(device.device_id)
+
+    def read_schedules(self, devices: list, timeout: float = 4) -> dict:
+        """Read the weekly schedule of several devices at the same time.
+        Returns the Schedule by device id of the devices that responded.
+        Devices that do not support the schedule are left out"""
+        devices = self.__supporting(devices, DukaPacket.Parameters.SCHEDULE_SETUP.value)
+        keys = Schedule.keys()
+        for device in devices:
+            device._schedule = {}
+            for i in range(0, len(keys), _SCHEDULE_BATCH):
+                packet = DukaPacket()
+                packet.initialize_read_schedule_cmd(
+                    device, keys[i : i + _SCHEDULE_BATCH]
+                )
+                self.__send_data(device, packet.data)
+        self.__wait_until(
+            lambda: all(len(device._schedule) == len(keys) for device in devices),
+            timeout,
+        )
+        schedules = {}
+        for device in devices:
+            schedule = device.schedule
+            if schedule.is_complete():
+                schedules[device.device_id] = schedule
+        return schedules
+
+    def write_schedule(
+        self, device: Device, desired: Schedule, timeout: float = 4
+    ) -> int:
+        """Write the desired schedule to the device.
+        Only the periods that differ from the current schedule of the device
+        are written. Returns the number of periods written, or None if the
+        device does not respond"""
+        return self.write_schedules([device], desired, timeout).get(device.device_id)
+
+    def write_schedules(
+        self, devices: list, desired: Schedule, timeout: float = 4
+    ) -> dict:
+        """Write the desired schedule to several devices.
+        The current schedules are read from all devices at the same time, and
+        only the periods that differ are written, several in each frame.
+        Returns the number of periods written by device id. Devices that do
+        not respond are left out"""
+        schedules = self.read_schedules(devices, timeout)
+        written = {}
+        for device in devices:
+            schedule: Schedule = schedules.get(device.device_id)
+            if schedule is None:
+                continue
+            periods = schedule.diff(desired)
+            for i in range(0, len(periods), _SCHEDULE_BATCH):
+                packet = DukaPacket()
+                packet.initialize_write_schedule_cmd(
+                    device, periods[i : i + _SCHEDULE_BATCH]
+                )
+                self.__send_data(device, packet.data)
+            written[device.device_id] = len(periods)
+        return written
+
+    def read_clocks(self, devices: list, timeout: float = 4) -> dict:
+        """Read the real time clock of several devices at the same time.
+        Returns the current time of the clock by device id of the devices
+        that responded. Devices without a clock are left out.
+        The time is INVALID_CLOCK if the clock of the device is not set"""
+        devices = self.__supporting(devices, DukaPacket.Parameters.RTC_TIME.value)
+        for device in devices:
+            device._rtc = None
+            packet = DukaPacket()
+            packet.initialize_read_rtc_cmd(device)
+            self.__send_data(device, packet.data)
+        self.__wait_until(
+            lambda: all(device._rtc is not None for device in devices), timeout
+        )
+        return {
+            device.device_id: device.rtc for device in devices if device.rtc is not None
+        }
+
+    def sync_clocks(
+        self, devices: list, tolerance: float = 30, timeout: float = 4
+    ) -> list:
+        """Set the real time clock of the devices to the local time.
+        Devices with a clock within tolerance seconds of the local time are
+        skipped, devices with a clock that is not set are always set.
+        Returns the ids of the devices that have been set"""
+        clocks = self.read_clocks(devices, timeout)
+        synced = []
+        for device in devices:
+            clock = clocks.get(device.device_id)
+            if clock is None:
+                continue
+            now = datetime.datetime.now()
+            if (
+                clock is not INVALID_CLOCK
+                and abs((clock - now).total_seconds()) <= tolerance
+            ):
+                continue
+            packet = DukaPacket()
+            packet.initialize_set_rtc_cmd(device, now)
+            self.__send_data(device, packet.data)
+            synced.append(device.device_id)
+        return synced
+
+    def write_parameters(self, device: Device, parameters: list):
+        """Write several parameters to the device in one frame.
+        The parameters are (parameter, value) tuples with 1 byte values"""
+        for parameter, value in parameters:
+            device.capabilities.check(device.device_id, parameter, value)
+        packet = DukaPacket()
+        packet.initialize_write_cmd(device, parameters)
         self.__send_data(device, packet.data)
 
     def validate_device(
@@ -139,48 +419,212 @@ class DukaClient:
     ) -> Device:
         """Validate if a device exist and repsonds.
         Returns None if the device does not exist
-        Returns the Device object if it exist
+        Returns the Device object if it exist. The device is not added
         """
         device: Device = self.get_device(device_id)
         # Is the device already added
         if device is not None:
             return device
-        device = self.add_device(device_id, password, ip_address)
+        # 4 sec timeout
+        probes = self.__probe([(device_id, password, ip_address)], 1, 4)
+        probe: _Probe = probes[device_id]
+        if probe.received is None:
+            return None
+        device = probe.device
+        values = {"ip_address": probe.address}
+        for name, _ in PACKET_FIELDS:
+            value = getattr(probe.packet, name)
+            if value is not None:
+                values[name] = value
+        device._state = device._state._replace(**values)
+        return device
+
+    def validate_devices(
+        self, entries, concurrency: int = 32, timeout: float = 4
+    ) -> dict:
+        """Validate if several devices exist and respond, at the same time.
+        The entries are (device_id, password, ip_address) tuples, where the
+        password and ip address may be left out.
+        The probes are sent concurrency at a time with a short pause in
+        between, and the devices that have not answered are probed again
+        half way through the timeout. The devices are not added.
+        Returns a ValidationResult by device id. A device with a wrong
+        password does not answer, so it can not be told from a missing one
+        """
+        probes = self.__probe(entries, concurrency, timeout)
+        return {device_id: self.__probe_result(p) for device_id, p in probes.items()}
+
+    def __probe(self, entries, concurrency: int, timeout: float) -> dict:
+        """Send the probes and wait for the responses without adding the
+        devices. Returns the probes by device id"""
+        probes = {}
+        for entry in entries:
+            if isinstance(entry, str):
+                entry = (entry,)
+            device = Device(*entry)
+            probes[device.device_id] = _Probe(device)
+        # the probes are published copy-on-write, a tuple of probes by device
+        # id, as several threads may validate the same device
+        with self._mutex:
+            published = dict(self._probes)
+            for device_id, probe in probes.items():
+                published[device_id] = published.get(device_id, ()) + (probe,)
+            self._probes = published
         try:
-            self.__update_device_status(device)
-            # 4 sec timeout
-            timeout = time.time() + 4
-            while True:
-                if device.mode is not None:
-                    return device
-                if time.time() > timeout:
+            self.__send_probes(probes.values(), concurrency)
+            deadline = time.monotonic() + timeout
+            retry = time.monotonic() + timeout / 2
+            while time.monotonic() < deadline:
+                waiting = [p for p in probes.values() if p.received is None]
+                if not waiting:
                     break
-                time.sleep(0.1)
-            return None
+                if retry is not None and time.monotonic() >= retry:
+                    self.__send_probes(waiting, concurrency)
+                    retry = None
+                time.sleep(0.01)
         finally:
-            self.remove_device(device.device_id)
-
-    def __update_device_status(self, device: Device):
-        """Update the device status from the DukaClient
-        You should not call this youself
+            with self._mutex:
+                published = dict(self._probes)
+                for device_id, probe in probes.items():
+                    remaining = tuple(
+                        p for p in published.get(device_id, ()) if p is not probe
+                    )
+                    if remaining:
+                        published[device_id] = remaining
+                    else:
+                        published.pop(device_id, None)
+                self._probes = published
+        return probes
+
+    def __send_probes(self, probes, concurrency: int):
+        """Send the probes in bursts of concurrency frames"""
+        self.__wait_for_socket()
+        for i, probe in enumerate(probes):
+            if i and i % concurrency == 0:
+                time.sleep(_PROBE_PACE)
+            packet = DukaPacket()
+            packet.initialize_read_cmd(probe.device, _PROBE_PARAMETERS)
+            probe.sent = time.perf_counter()
+            self.__send_data(probe.device, packet.data)
+
+    def __probe_result(self, probe: _Probe) -> ValidationResult:
+        device_id = probe.device.device_id
+        if probe.received is None:
+            return ValidationResult(device_id, False, "wrong password or no reply")
+        return ValidationResult(
+            device_id,
+            True,
+            ip_address=probe.address,
+            rtt=max(probe.received - probe.sent, 0.0),
+            firmware_version=probe.packet.firmware_version,
+            unit_type=probe.packet.unit_type,
+        )
+
+    def __poll_devices(self):
+        """Send a read command to the devices with status parameters that are
+        due to be read. Parameters due within the merge window are read in
+        the same frame, to send as few and as small frames as possible.
+        The devices are checked in sweeps, sending at most _POLL_BURST frames
+        every _POLL_PACE seconds.
         """
-        packet = DukaPacket()
-        packet.initialize_status_cmd(device)
-        data = packet.data
-        self.__send_data(device, data)
-
-    def __update_all_device_status(self):
-        """Send an update command to all devices"""
-        for device_id in self._devices:
-            self.__update_device_status(self._devices[device_id])
-
-    def __send_data(self, device: Device, data):
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        sweep = self._sweep
+        if not sweep:
+            # the devices left to check in this sweep, the next one last
+            sweep = self._sweep = list(self._devices.view().values())
+            sweep.reverse()
+            self._sweep_next = now + DEFAULT_POLL_INTERVAL
+        horizon = now + _POLL_MERGE_WINDOW
+        next_poll = self._sweep_next
+        sent = 0
+        while sweep and sent < _POLL_BURST:
+            device = sweep.pop()
+            if self._devices.get(device.device_id) is not device:
+                # removed during the sweep
+                continue
+            intervals = device._poll_intervals
+            due = device._poll_due
+            supported = device._capabilities.parameters
+            parameters = []
+            for parameter in _POLL_PARAMETERS:
+                interval = intervals.get(parameter, DEFAULT_POLL_INTERVAL)
+                if interval is None or parameter not in supported:
+                    continue
+                when = due.get(parameter, 0)
+                if when <= horizon:
+                    parameters.append(parameter)
+                    when = due[parameter] = now + interval
+                if when < next_poll:
+                    next_poll = when
+            if not parameters:
+                continue
+            if (
+                DukaPacket.Parameters.SPEED.value in parameters
+                and DukaPacket.Parameters.ON_OFF.value in supported
+            ):
+                parameters.insert(0, DukaPacket.Parameters.ON_OFF.value)
+            if device.firmware_version is None:
+                # the response to the get firmware command has been lost
+                parameters.append(DukaPacket.Parameters.READ_FIRMWARE_VERSION.value)
+                parameters.append(DukaPacket.Parameters.UNIT_TYPE.value)
+            packet = DukaPacket()
+            packet.initialize_read_cmd(device, parameters)
+            self.__send_data(device, packet.data)
+            sent += 1
+        if sweep:
+            self._sweep_next = next_poll
+            self._next_poll = now + _POLL_PACE
+        else:
+            self._next_poll = next_poll
+
+    def __send_data(
+        self, device: Device, data, parameter: int = None, final: bool = False
+    ):
         """Send a data packet to a device.
         Protect it with a mutex to prevent multiple threads doint it at the
-        same time"""
+        same time.
+        The parameter is used for tracing the command the packet is sent for
+        """
+        tracer = self._tracer if parameter is not None else None
         self.__wait_for_socket()
-        with DukaClient._mutex:
+        if tracer is not None:
+            tracer.stage(device.device_id, parameter, "socket_ready")
+        with self._mutex:
+            if tracer is not None:
+                tracer.stage(device.device_id, parameter, "lock_acquired")
             self._sock.sendto(data, (device.ip_address, 4000))
+        if tracer is not None:
+            tracer.stage(device.device_id, parameter, "sent", final)
+
+    def __supporting(self, devices: list, parameter) -> list:
+        """Return the devices that support the parameter"""
+        return [
+            device for device in devices if device._capabilities.supports(parameter)
+        ]
+
+    def __wait_until(self, condition, timeout: float) -> bool:
+        """Wait for the notify thread to fulfill the condition.
+        Returns False on timeout"""
+        timeout = time.time() + timeout
+        while not condition():
+            if time.time() > timeout:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def __begin_command(self, device: Device, parameter: int, name: str, value=None):
+        """Start tracing a command writing the value"""
+        if self._tracer is not None:
+            self._tracer.begin_command(device.device_id, parameter, name, value)
+
+    def __sleep(self, device: Device, seconds: float):
+        """Sleep between two commands to a device"""
+        start = time.perf_counter()
+        time.sleep(seconds)
+        if self._tracer is not None:
+            self._tracer.span(device.device_id, "sleep", start, time.perf_counter())
 
     def __wait_for_socket(self):
         """Wait for notify thread to create socket """
@@ -203,8 +647,8 @@ class DukaClient:
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
         self._sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
-        self._sock.bind(("0.0.0.0", 4000))
-        self._sock.settimeout(1.0)
+        self._sock.setsockopt(SOL_SOCKET, SO_RCVBUF, _RECEIVE_BUFFER_SIZE)
+        self._sock.bind(("0.0.0.0", self._port))
         self._socket_listening = True
 
     def __close_socket(self):
@@ -231,18 +675,19 @@ class DukaClient:
 
     def __receive_data(self):
         """Receive data from the socket.
-        If there is a timeout. Send an update command the the devices.
+        Send read commands to the devices when status parameters are due.
         Return (None, None) where there is no data to process
         """
         try:
+            self.__poll_devices()
+            # wake up when the next parameter is due, but at least every
+            # second to check if the notify thread should stop
+            timeout = min(self._next_poll - time.monotonic(), 1.0)
+            self._sock.settimeout(max(timeout, 0.01))
             data, addr = self._sock.recvfrom(1024)
             return (data, addr)
         except socket.timeout:
-            try:
-                self.__update_all_device_status()
-            except socket.error:
-                # recreate soket on error
-                self.__close_socket()
+            pass
         except socket.error:
             # recreate soket on error
             self.__close_socket()
@@ -259,64 +704,188 @@ class DukaClient:
                 data, addr = self.__receive_data()
                 if data is None:
                     continue
+                received = time.perf_counter()
+                self._frames_received += 1
+                if self.__apply_known_frame(data, addr):
+                    continue
                 # print(''.join('{:02x}'.format(x) for x in data))
                 packet = ResponsePacket()
                 if not packet.initialize_from_data(data):
                     continue
-                if packet.device_id not in self._devices:
+                if self._tracer is not None:
+                    self._tracer.response_stage(
+                        packet.device_id, packet, "received", at=received
+                    )
+                    self._tracer.response_stage(packet.device_id, packet, "decoded")
+                if self._probes:
+                    self.__match_probe(packet, addr, received)
+                device: Device = self._devices.get(packet.device_id)
+                if device is None:
                     if (
                         packet.search_device_id is not None
                         and self._found_device_callback is not None
                     ):
                         self._found_device_callback(packet.search_device_id)
                     continue
-                device: Device = self._devices[packet.device_id]
                 ip_address = addr[0]
                 self.update_device(device, ip_address, packet)
+                self.__remember_frame(device, addr, data, packet)
         finally:
             self.__close_socket()
             self._notifyrunning = False
 
-    def update_device(self, device, ip_address: str, packet: ResponsePacket):
-        """Update the device with data recieved. Called by the dukaclient"""
-        haschange = False
-        if device._ip_address is not None and ip_address != device._ip_address:
-            self._ip_address = ip_address
-            haschange = True
-        if packet.speed is not None and packet.speed != device._speed:
-            device._speed = packet.speed
-            haschange = True
-        if packet.manualspeed is not None and packet.manualspeed != device._manualspeed:
-            device._manualspeed = packet.manualspeed
-            haschange = True
-        if packet.mode is not None and packet.mode != device._mode:
-            device._mode = packet.mode
-            haschange = True
+    def __apply_known_frame(self, data: bytes, addr) -> bool:
+        """Apply a frame without decoding it, if it is identical to the last
+        frame from the device and address, or only differs in the fan rpm.
+        Returns False if the frame must be decoded
+        """
+        if self._probes or (self._tracer is not None and self._tracer._pending):
+            # the probes and the traced commands need the decoded responses
+            return False
+        try:
+            device = self._devices.get(data[4 : 4 + data[3]].decode())
+        except (IndexError, UnicodeDecodeError):
+            return False
+        if device is None:
+            return False
+        last = device._last_frame
+        if last is None or last[0] != addr:
+            return False
+        _, frame, pos, checksum, fields = last
+        if data == frame:
+            device._last_seen = now = time.monotonic()
+            self.__seen(device, fields, now)
+            self._frames_identical += 1
+            return True
         if (
-            packet.filter_alarm is not None
-            and packet.filter_alarm != device._filter_alarm
+            pos is None
+            or len(data) != len(frame)
+            or data[:pos] != frame[:pos]
+            or data[pos + 2 : -2] != frame[pos + 2 : -2]
         ):
-            device._filter_alarm = packet.filter_alarm
-            haschange = True
+            return False
+        # only the rpm differs, so the checksum only differs by the rpm bytes
+        checksum += data[pos] + data[pos + 1] - frame[pos] - frame[pos + 1]
+        checksum &= 0xFFFF
+        if checksum != data[-2] + (data[-1] << 8):
+            return False
+        device._last_frame = (addr, data, pos, checksum, fields)
+        device._last_seen = now = time.monotonic()
+        self.__seen(device, fields, now)
+        state: DeviceState = device._state
+        fan1rpm = data[pos] + (data[pos + 1] << 8)
+        device._state = state._replace(sequence=state.sequence + 1, fan1rpm=fan1rpm)
+        if self._journal is not None:
+            self._journal.record(
+                time.time(),
+                device.device_id,
+                Change.FAN1RPM.value,
+                {"fan1rpm": fan1rpm},
+                device._state,
+            )
+        device.notify_change(Change.FAN1RPM)
+        self._frames_rpm_only += 1
+        return True
+
+    def __match_probe(self, packet: ResponsePacket, addr, received: float):
+        """Record the response to the validation probes of the device"""
+        if packet.firmware_version is None:
+            # not the response to a probe
+            return
+        for probe in self._probes.get(packet.device_id, ()):
+            if probe.received is None:
+                probe.address = addr[0]
+                probe.packet = packet
+                probe.received = received
+
+    def __remember_frame(self, device: Device, addr, data: bytes, packet):
+        """Remember the last frame from the device, so identical frames can
+        be applied without decoding them. Frames with the schedule or the
+        clock are not remembered, as they are read again on purpose"""
         if (
-            packet.filter_timer is not None
-            and packet.filter_timer != device._filter_timer
+            packet.schedule_periods is None
+            and packet.weekly_schedule is None
+            and packet.rtc is None
         ):
-            device._filter_timer = packet.filter_timer
-            haschange = True
-        if packet.humidity is not None and packet.humidity != device._humidity:
-            device._humidity = packet.humidity
-            haschange = True
-        if packet.firmware_version is not None:
-            device._firmware_version = packet.firmware_version
-        if packet.firmware_date is not None:
-            device._firmware_date = packet.firmware_date
-        if packet.unit_type is not None:
-            device._unit_type = packet.unit_type
-        if haschange and device._changeevent is not None:
-            device._changeevent(device)
+            checksum = data[-2] + (data[-1] << 8)
+            fields = 0
+            for name, flag in _PACKET_FIELDS:
+                if getattr(packet, name) is not None:
+                    fields |= flag
+            device._last_frame = (addr, data, packet.fan1rpm_pos, checksum, fields)
+        else:
+            device._last_frame = None
+
+    def __seen(self, device: Device, fields: int, now: float):
+        """Record the time the fields were received from the device"""
+        seen = device._seen
+        if fields in seen:
+            seen[fields] = now
+        elif fields:
+            # a copy, so the readers can iterate it while it is updated
+            seen = dict(seen)
+            seen[fields] = now
+            device._seen = seen
+
+    def update_device(self, device, ip_address: str, packet: ResponsePacket) -> Change:
+        """Update the device with data recieved. Called by the dukaclient
+
+        The changed values are published as a new immutable DeviceState, so
+        other threads always see either the old or the new state.
+        Returns the fields that have changed
+        """
+        device._last_seen = now = time.monotonic()
+        state: DeviceState = device._state
+        changes = {}
+        mask = 0
+        fields = 0
+        if state.ip_address is not None and ip_address != state.ip_address:
+            changes["ip_address"] = ip_address
+            mask = Change.IP_ADDRESS.value
+        for name, flag in _PACKET_FIELDS:
+            value = getattr(packet, name)
+            if value is not None:
+                fields |= flag
+                if value != getattr(state, name):
+                    changes[name] = value
+                    mask |= flag
+        seen = device._seen
+        if fields in seen:
+            seen[fields] = now
+        else:
+            self.__seen(device, fields, now)
+        if changes:
+            device._state = state._replace(sequence=state.sequence + 1, **changes)
+            if self._journal is not None:
+                self._journal.record(
+                    time.time(), device.device_id, mask, changes, device._state
+                )
+            if mask & _TYPE_CHANGES:
+                device._capabilities = get_capabilities(
+                    device._state.unit_type, device._state.firmware_version
+                )
+        if packet.unsupported is not None:
+            # the device has answered that it does not support the parameters
+            device._capabilities = device._capabilities.without(packet.unsupported)
+        if packet.schedule_periods is not None:
+            schedule = dict(device._schedule)
+            for period in packet.schedule_periods:
+                schedule[(period.day, period.period)] = period
+            device._schedule = schedule
+        if packet.weekly_schedule is not None:
+            device._weekly_schedule = packet.weekly_schedule
+        if packet.rtc is not None:
+            device._rtc = (packet.rtc, time.monotonic())
+        tracer = self._tracer
+        if tracer is not None:
+            tracer.response_stage(device.device_id, packet, "applied")
         # note we do not want the fan rpm to trigger change event because it
-        # changes all the time
-        if packet.fan1rpm is not None and packet.fan1rpm != device._fan1rpm:
-            device._fan1rpm = packet.fan1rpm
-        return
+        # changes all the time. Listeners can subscribe to it
+        changed = _CHANGES.get(mask)
+        if changed is None:
+            changed = _CHANGES[mask] = Change(mask)
+        if mask:
+            device.notify_change(changed)
+        if tracer is not None:
+            tracer.response_stage(device.device_id, packet, "callback_done", True)
+        return changed
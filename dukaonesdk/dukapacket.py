@@ -1,13 +1,17 @@
 """Implements a class for the UDP data packet"""
+import datetime
 from enum import Enum
 from .device import Device
 from .mode import Mode
+from .schedule import SchedulePeriod
 from .speed import Speed
 
 
 class DukaPacket:
     """A udp data packet to/from the duka device."""
 
+    __slots__ = ("_data", "_pos", "maxsize")
+
     class Func(Enum):
         READ = 1
         WRITE = 2
@@ -24,6 +28,10 @@ class DukaPacket:
         FAN1RPM = 0x4A
         FILTER_TIMER = 0x64
         RESET_FILTER_TIMER = 0x65
+        RTC_TIME = 0x6F
+        RTC_CALENDAR = 0x70
+        WEEKLY_SCHEDULE = 0x72
+        SCHEDULE_SETUP = 0x77
         SEARCH = 0x7C
         RESET_ALARMS = 0x80
         READ_ALARM = 0x83
@@ -32,6 +40,18 @@ class DukaPacket:
         VENTILATION_MODE = 0xB7
         UNIT_TYPE = 0xB9
 
+    # The parameters read by the status command
+    status_parameters = (
+        Parameters.ON_OFF.value,
+        Parameters.VENTILATION_MODE.value,
+        Parameters.SPEED.value,
+        Parameters.MANUAL_SPEED.value,
+        Parameters.FAN1RPM.value,
+        Parameters.FILTER_ALARM.value,
+        Parameters.FILTER_TIMER.value,
+        Parameters.CURRENT_HUMIDITY.value,
+    )
+
     def __init__(self):
         self._data = None
         self._pos = 0
@@ -88,16 +108,23 @@ class DukaPacket:
 
     def initialize_status_cmd(self, device: Device):
         """Initialize a status command packet to be sent to a device"""
+        self.initialize_read_cmd(device, self.status_parameters)
+
+    def initialize_read_cmd(self, device: Device, parameters):
+        """Initialize a command packet reading the specified parameters"""
         self.__build_data(device.device_id, device.password)
         self.__add_byte(self.Func.READ.value)
-        self.__add_byte(self.Parameters.ON_OFF.value)
-        self.__add_byte(self.Parameters.VENTILATION_MODE.value)
-        self.__add_byte(self.Parameters.SPEED.value)
-        self.__add_byte(self.Parameters.MANUAL_SPEED.value)
-        self.__add_byte(self.Parameters.FAN1RPM.value)
-        self.__add_byte(self.Parameters.FILTER_ALARM.value)
-        self.__add_byte(self.Parameters.FILTER_TIMER.value)
-        self.__add_byte(self.Parameters.CURRENT_HUMIDITY.value)
+        for parameter in parameters:
+            self.__add_byte(parameter)
+        self.__add_checksum()
+
+    def initialize_write_cmd(self, device: Device, parameters):
+        """Initialize a command packet writing several (parameter, value)
+        with 1 byte values in one frame"""
+        self.__build_data(device.device_id, device.password)
+        self.__add_byte(self.Func.WRITEREAD.value)
+        for parameter, value in parameters:
+            self.__add_parameter(parameter, value)
         self.__add_checksum()
 
     def initialize_reset_filter_alarm_cmd(self, device: Device):
@@ -117,6 +144,63 @@ class DukaPacket:
         self.__add_byte(self.Parameters.UNIT_TYPE.value)
         self.__add_checksum()
 
+    def initialize_read_schedule_cmd(self, device: Device, keys):
+        """Initialize a command packet reading the schedule periods with the
+        specified (day, period) keys and the weekly schedule state"""
+        self.__build_data(device.device_id, device.password)
+        self.__add_byte(self.Func.READ.value)
+        self.__add_byte(self.Parameters.WEEKLY_SCHEDULE.value)
+        for day, period in keys:
+            # the period to read is specified with a 2 byte value
+            self.__add_byte(0xFE)
+            self.__add_byte(2)
+            self.__add_byte(self.Parameters.SCHEDULE_SETUP.value)
+            self.__add_byte(day)
+            self.__add_byte(period)
+        self.__add_checksum()
+
+    def initialize_write_schedule_cmd(self, device: Device, periods):
+        """Initialize a command packet writing the schedule periods"""
+        self.__build_data(device.device_id, device.password)
+        self.__add_byte(self.Func.WRITEREAD.value)
+        period: SchedulePeriod
+        for period in periods:
+            self.__add_byte(self.Parameters.SCHEDULE_SETUP.value)
+            for byte in period.to_bytes():
+                self.__add_byte(byte)
+        self.__add_checksum()
+
+    def initialize_weekly_schedule_cmd(self, device: Device, enabled: bool):
+        """Initialize a command packet turning the weekly schedule on or off"""
+        self.__build_data(device.device_id, device.password)
+        self.__add_byte(self.Func.WRITEREAD.value)
+        self.__add_byte(self.Parameters.WEEKLY_SCHEDULE.value)
+        self.__add_byte(1 if enabled else 0)
+        self.__add_checksum()
+
+    def initialize_read_rtc_cmd(self, device: Device):
+        """Initialize a command packet reading the real time clock"""
+        self.__build_data(device.device_id, device.password)
+        self.__add_byte(self.Func.READ.value)
+        self.__add_byte(self.Parameters.RTC_TIME.value)
+        self.__add_byte(self.Parameters.RTC_CALENDAR.value)
+        self.__add_checksum()
+
+    def initialize_set_rtc_cmd(self, device: Device, now: datetime.datetime):
+        """Initialize a command packet setting the real time clock"""
+        self.__build_data(device.device_id, device.password)
+        self.__add_byte(self.Func.WRITEREAD.value)
+        self.__add_byte(self.Parameters.RTC_TIME.value)
+        self.__add_byte(now.second)
+        self.__add_byte(now.minute)
+        self.__add_byte(now.hour)
+        self.__add_byte(self.Parameters.RTC_CALENDAR.value)
+        self.__add_byte(now.day)
+        self.__add_byte(now.isoweekday())
+        self.__add_byte(now.month)
+        self.__add_byte(now.year - 2000)
+        self.__add_checksum()
+
     @property
     def data(self):
         """Return the data for the packet"""
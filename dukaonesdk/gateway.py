@@ -0,0 +1,338 @@
+"""Implements a gateway daemon sharing one DukaClient between local processes.
+
+Only one process can own UDP port 4000. The gateway owns the DukaClient and
+serves the devices to any number of local clients over a Unix domain socket.
+Use the GatewayClient in gatewayclient.py to connect to it.
+
+Start the gateway with: python -m dukaonesdk.gateway --socket /tmp/dukaone.sock
+
+Each message is a 4 byte big endian length followed by a compact JSON
+object. A request has an "id", a "cmd" and "args"; the response has the same
+"id" and either a "result" or an "error". After a "subscribe" request the
+gateway pushes {"event": "change", "device": {...}} messages when any field
+of a device changes and {"event": "found", "device_id": ...} messages during
+a search.
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+
+from .change import Change
+from .device import Device
+from .dukaclient import DukaClient
+from .journal import Journal
+from .schedule import Schedule, SchedulePeriod
+
+DEFAULT_SOCKET_PATH = "/tmp/dukaone.sock"
+
+_HEADER = struct.Struct("!I")
+_MAX_MESSAGE_SIZE = 1 << 20
+
+
+def send_message(sock: socket.socket, message: dict):
+    """Send a framed message on the socket"""
+    payload = json.dumps(message, separators=(",", ":")).encode()
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def receive_message(sock: socket.socket) -> dict:
+    """Receive a framed message from the socket.
+    Returns None if the connection is closed
+    """
+    header = _receive_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > _MAX_MESSAGE_SIZE:
+        raise ValueError(f"Message size {size} is too large")
+    payload = _receive_exactly(sock, size)
+    if payload is None:
+        return None
+    return json.loads(payload)
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+    """Receive exactly size bytes. Returns None if the connection is closed"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def device_state(device: Device) -> dict:
+    """Return the state of a device as a dict that can be sent to a client"""
+    state = device.state._asdict()
+    state["device_id"] = device.device_id
+    return state
+
+
+def schedule_to_list(schedule: Schedule) -> list:
+    """Return the periods of a schedule as lists that can be sent to a client"""
+    return [list(period) for period in schedule.periods()]
+
+
+def schedule_from_list(periods: list) -> Schedule:
+    """Return a schedule from the periods sent by schedule_to_list"""
+    return Schedule(SchedulePeriod(*period) for period in periods)
+
+
+class _Connection(socketserver.BaseRequestHandler):
+    """Handles a single local client connection"""
+
+    def setup(self):
+        self._outgoing = queue.Queue()
+        self._writer = threading.Thread(target=self.__write_fn, daemon=True)
+        self._writer.start()
+
+    def handle(self):
+        gateway: Gateway = self.server.gateway
+        try:
+            while True:
+                message = receive_message(self.request)
+                if message is None:
+                    break
+                if message.get("cmd") == "subscribe":
+                    gateway.subscribe(self)
+                    self.push({"id": message.get("id"), "result": None})
+                    continue
+                self.push(gateway.handle_request(self, message))
+        except (OSError, ValueError):
+            pass
+        finally:
+            gateway.unsubscribe(self)
+
+    def finish(self):
+        self._outgoing.put(None)
+        self._writer.join()
+
+    def push(self, message: dict):
+        """Queue a message for the client. Messages are sent by a writer
+        thread so a slow client can not block the notify thread"""
+        self._outgoing.put(message)
+
+    def __write_fn(self):
+        while True:
+            message = self._outgoing.get()
+            if message is None:
+                return
+            try:
+                send_message(self.request, message)
+            except OSError:
+                return
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Gateway:
+    """Serves the devices of a DukaClient over a Unix domain socket"""
+
+    def __init__(self, client: DukaClient, path: str = DEFAULT_SOCKET_PATH):
+        self._client = client
+        self._path = path
+        self._subscribers = set()
+        self._subscribers_mutex = threading.Lock()
+        self._server = None
+
+    def serve_forever(self):
+        """Listen on the socket and serve clients until shutdown is called"""
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._server = _Server(self._path, _Connection)
+        self._server.gateway = self
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self._path)
+
+    def shutdown(self):
+        """Stop serving clients"""
+        if self._server is not None:
+            self._server.shutdown()
+
+    def subscribe(self, connection: _Connection):
+        """Push change events to the connection"""
+        with self._subscribers_mutex:
+            self._subscribers.add(connection)
+
+    def unsubscribe(self, connection: _Connection):
+        """Stop pushing change events to the connection"""
+        with self._subscribers_mutex:
+            self._subscribers.discard(connection)
+
+    def broadcast(self, message: dict):
+        """Push a message to all subscribed connections"""
+        with self._subscribers_mutex:
+            subscribers = list(self._subscribers)
+        for connection in subscribers:
+            connection.push(message)
+
+    def handle_request(self, connection: _Connection, message: dict) -> dict:
+        """Execute a request and return the response message"""
+        handler = getattr(self, "_cmd_" + str(message.get("cmd")), None)
+        if handler is None:
+            return {"id": message.get("id"), "error": "Unknown command"}
+        try:
+            result = handler(connection, **message.get("args", {}))
+        except Exception as error:  # pylint: disable=broad-except
+            return {"id": message.get("id"), "error": str(error)}
+        return {"id": message.get("id"), "result": result}
+
+    def __onchange(self, device: Device, changes: Change):
+        self.broadcast({"event": "change", "device": device_state(device)})
+
+    def __get_device(self, device_id: str) -> Device:
+        device = self._client.get_device(device_id)
+        if device is None:
+            raise KeyError(f"Unknown device {device_id}")
+        return device
+
+    def __get_devices(self, device_ids: list) -> list:
+        return [self.__get_device(device_id) for device_id in device_ids]
+
+    def _cmd_add_device(
+        self,
+        connection,
+        device_id: str,
+        password: str = None,
+        ip_address: str = "<broadcast>",
+    ):
+        isnew = self._client.get_device(device_id) is None
+        device = self._client.add_device(device_id, password, ip_address)
+        if isnew:
+            device.add_listener(self.__onchange)
+        return device_state(device)
+
+    def _cmd_remove_device(self, connection, device_id: str):
+        device = self._client.remove_device(device_id)
+        return None if device is None else device_state(device)
+
+    def _cmd_get_devices(self, connection):
+        return [
+            dict(state._asdict(), device_id=device_id)
+            for device_id, state in self._client.snapshot().items()
+        ]
+
+    def _cmd_stats(self, connection):
+        return self._client.stats()
+
+    def _cmd_search_devices(self, connection):
+        def found(device_id: str):
+            connection.push({"event": "found", "device_id": device_id})
+
+        self._client.search_devices(found)
+
+    def _cmd_validate_device(
+        self,
+        connection,
+        device_id: str,
+        password: str = None,
+        ip_address: str = "<broadcast>",
+    ):
+        device = self._client.validate_device(device_id, password, ip_address)
+        return None if device is None else device_state(device)
+
+    def _cmd_validate_devices(
+        self, connection, entries: list, concurrency: int = 32, timeout: float = 4
+    ):
+        results = self._client.validate_devices(entries, concurrency, timeout)
+        return {device_id: r._asdict() for device_id, r in results.items()}
+
+    def _cmd_set_speed(self, connection, device_id: str, speed: int):
+        self._client.set_speed(self.__get_device(device_id), speed)
+
+    def _cmd_set_manual_speed(self, connection, device_id: str, manualspeed: int):
+        self._client.set_manual_speed(self.__get_device(device_id), manualspeed)
+
+    def _cmd_turn_off(self, connection, device_id: str):
+        self._client.turn_off(self.__get_device(device_id))
+
+    def _cmd_turn_on(self, connection, device_id: str):
+        self._client.turn_on(self.__get_device(device_id))
+
+    def _cmd_set_mode(self, connection, device_id: str, mode: int):
+        self._client.set_mode(self.__get_device(device_id), mode)
+
+    def _cmd_set_poll_interval(
+        self, connection, device_id: str, parameter: int, seconds: float
+    ):
+        self._client.set_poll_interval(self.__get_device(device_id), parameter, seconds)
+
+    def _cmd_reset_filter_alarm(self, connection, device_id: str):
+        self._client.reset_filter_alarm(self.__get_device(device_id))
+
+    def _cmd_write_parameters(self, connection, device_id: str, parameters: list):
+        self._client.write_parameters(
+            self.__get_device(device_id),
+            [(parameter, value) for parameter, value in parameters],
+        )
+
+    def _cmd_request_status(self, connection, device_ids: list):
+        self._client.request_status(self.__get_devices(device_ids))
+
+    def _cmd_set_weekly_schedule(self, connection, device_id: str, enabled: bool):
+        self._client.set_weekly_schedule(self.__get_device(device_id), enabled)
+
+    def _cmd_read_schedules(self, connection, device_ids: list, timeout: float = 4):
+        devices = self.__get_devices(device_ids)
+        schedules = self._client.read_schedules(devices, timeout)
+        return {
+            device_id: schedule_to_list(schedule)
+            for device_id, schedule in schedules.items()
+        }
+
+    def _cmd_write_schedules(
+        self, connection, device_ids: list, periods: list, timeout: float = 4
+    ):
+        devices = self.__get_devices(device_ids)
+        return self._client.write_schedules(
+            devices, schedule_from_list(periods), timeout
+        )
+
+    def _cmd_read_clocks(self, connection, device_ids: list, timeout: float = 4):
+        clocks = self._client.read_clocks(self.__get_devices(device_ids), timeout)
+        return {device_id: clock.isoformat() for device_id, clock in clocks.items()}
+
+    def _cmd_sync_clocks(
+        self,
+        connection,
+        device_ids: list,
+        tolerance: float = 30,
+        timeout: float = 4,
+    ):
+        devices = self.__get_devices(device_ids)
+        return self._client.sync_clocks(devices, tolerance, timeout)
+
+
+def main():
+    """Run the gateway until interrupted"""
+    parser = argparse.ArgumentParser(description="Duka One gateway daemon")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH)
+    parser.add_argument("--port", type=int, default=4000)
+    parser.add_argument("--journal", help="record the state changes in this file")
+    args = parser.parse_args()
+    journal = Journal(args.journal) if args.journal else None
+    client = DukaClient(port=args.port, journal=journal)
+    gateway = Gateway(client, args.socket)
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+        if journal is not None:
+            journal.close()
+
+
+if __name__ == "__main__":
+    main()
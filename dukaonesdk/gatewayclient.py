@@ -0,0 +1,362 @@
+"""Implements a client for the duka one gateway daemon"""
+import datetime
+import itertools
+import queue
+import socket
+import threading
+import time
+
+from .change import Change
+from .device import INVALID_CLOCK, Device, DeviceState, Mode, Speed, changed_fields
+from .dukaclient import ValidationResult
+from .gateway import (
+    DEFAULT_SOCKET_PATH,
+    receive_message,
+    schedule_from_list,
+    schedule_to_list,
+    send_message,
+)
+from .registry import DeviceRegistry
+from .schedule import Schedule
+
+
+class GatewayClient:
+    """Client object for connecting to the devices through a gateway.
+
+    It has the same methods as the DukaClient, but the devices are owned and
+    polled by the gateway daemon, so any number of processes can use them.
+    The onchange callbacks and listeners are called on an event thread, not
+    the thread receiving the responses, so they can send commands.
+    """
+
+    def __init__(self, path: str = DEFAULT_SOCKET_PATH, timeout: float = 10.0):
+        self._devices = DeviceRegistry()
+        self._timeout = timeout
+        self._found_device_callback = None
+        self._requestids = itertools.count(1)
+        self._pending = {}
+        self._mutex = threading.Lock()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._events = queue.Queue()
+        self._eventthread = threading.Thread(target=self.__event_fn, daemon=True)
+        self._eventthread.start()
+        self._receivethread = threading.Thread(target=self.__receive_fn, daemon=True)
+        self._receivethread.start()
+        self.__request("subscribe")
+
+    def close(self):
+        """Close the connection to the gateway and wait for the receive and
+        event threads to end"""
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._receivethread.join()
+        self._events.put(None)
+        if self._eventthread is not threading.current_thread():
+            self._eventthread.join()
+
+    def add_device(
+        self,
+        device_id: str,
+        password: str = None,
+        ip_address: str = "<broadcast>",
+        onchange=None,
+    ) -> Device:
+        """Add a new device. If the device already exist the current one will
+        be returned"""
+        state = self.__request(
+            "add_device",
+            device_id=device_id,
+            password=password,
+            ip_address=ip_address,
+        )
+        device: Device = self.get_device(device_id)
+        if device is None:
+            device = self._devices.add(
+                Device(device_id, password, ip_address, onchange)
+            )
+        self.update_device(device, state)
+        return device
+
+    def remove_device(self, device_id):
+        """Remove an existing device"""
+        self.__request("remove_device", device_id=device_id)
+        return self._devices.remove(device_id)
+
+    def get_device(self, device_id: str) -> Device:
+        """Get a device by device id."""
+        return self._devices.get(device_id)
+
+    def get_device_count(self):
+        """Return the number of devices"""
+        return len(self._devices)
+
+    def stats(self) -> dict:
+        """Return the frame counters of the client of the gateway"""
+        return self.__request("stats")
+
+    def snapshot(self) -> dict:
+        """Return the current state of every device by device id"""
+        return {
+            device_id: device.state
+            for device_id, device in self._devices.view().items()
+        }
+
+    def set_poll_interval(self, device: Device, parameter: int, seconds: float):
+        """Set the number of seconds between reading a status parameter of the
+        device. Use None to stop reading the parameter. The poll interval is
+        shared by all clients of the gateway"""
+        self.__request(
+            "set_poll_interval",
+            device_id=device.device_id,
+            parameter=int(getattr(parameter, "value", parameter)),
+            seconds=seconds,
+        )
+
+    def search_devices(self, callback):
+        """Search for devices. The callback is called for each device found"""
+        self._found_device_callback = callback
+        self.__request("search_devices")
+
+    def set_speed(self, device: Device, speed: Speed):
+        """Set the speed of the specified device"""
+        self.__request("set_speed", device_id=device.device_id, speed=speed)
+
+    def set_manual_speed(self, device: Device, manualspeed: int):
+        """Set the manual speed of the specified device"""
+        self.__request(
+            "set_manual_speed", device_id=device.device_id, manualspeed=manualspeed
+        )
+
+    def turn_off(self, device: Device):
+        """Turn off the specified device"""
+        self.__request("turn_off", device_id=device.device_id)
+
+    def turn_on(self, device: Device):
+        """Turn on the specified device"""
+        self.__request("turn_on", device_id=device.device_id)
+
+    def set_mode(self, device: Device, mode: Mode):
+        """Set the mode of the specified device"""
+        self.__request("set_mode", device_id=device.device_id, mode=mode)
+
+    def reset_filter_alarm(self, device: Device):
+        """Reset the filter alarm"""
+        self.__request("reset_filter_alarm", device_id=device.device_id)
+
+    def write_parameters(self, device: Device, parameters: list):
+        """Write several (parameter, value) to the device in one frame"""
+        self.__request(
+            "write_parameters",
+            device_id=device.device_id,
+            parameters=[
+                (int(getattr(parameter, "value", parameter)), int(value))
+                for parameter, value in parameters
+            ],
+        )
+
+    def request_status(self, devices: list):
+        """Send a status read to the devices now, without waiting for the
+        poll interval"""
+        self.__request(
+            "request_status", device_ids=[device.device_id for device in devices]
+        )
+
+    def set_weekly_schedule(self, device: Device, enabled: bool):
+        """Turn the weekly schedule of the device on or off"""
+        self.__request(
+            "set_weekly_schedule", device_id=device.device_id, enabled=enabled
+        )
+
+    def read_schedule(self, device: Device, timeout: float = 4) -> Schedule:
+        """Read the weekly schedule of the device.
+        Returns None if the device does not respond"""
+        return self.read_schedules([device], timeout).get(device.device_id)
+
+    def read_schedules(self, devices: list, timeout: float = 4) -> dict:
+        """Read the weekly schedule of several devices at the same time.
+        Returns the Schedule by device id of the devices that responded"""
+        result = self.__request(
+            "read_schedules",
+            wait=self._timeout + timeout,
+            device_ids=[device.device_id for device in devices],
+            timeout=timeout,
+        )
+        schedules = {}
+        for device in devices:
+            periods = result.get(device.device_id)
+            if periods is None:
+                continue
+            schedule = schedules[device.device_id] = schedule_from_list(periods)
+            device._schedule = {
+                (period.day, period.period): period for period in schedule.periods()
+            }
+        return schedules
+
+    def write_schedule(
+        self, device: Device, desired: Schedule, timeout: float = 4
+    ) -> int:
+        """Write the periods of the desired schedule that differ to the
+        device. Returns the number of periods written, or None if the device
+        does not respond"""
+        return self.write_schedules([device], desired, timeout).get(device.device_id)
+
+    def write_schedules(
+        self, devices: list, desired: Schedule, timeout: float = 4
+    ) -> dict:
+        """Write the desired schedule to several devices.
+        Returns the number of periods written by device id"""
+        return self.__request(
+            "write_schedules",
+            wait=self._timeout + timeout,
+            device_ids=[device.device_id for device in devices],
+            periods=schedule_to_list(desired),
+            timeout=timeout,
+        )
+
+    def read_clocks(self, devices: list, timeout: float = 4) -> dict:
+        """Read the real time clock of several devices at the same time.
+        Returns the current time of the clock by device id of the devices
+        that responded. The time is INVALID_CLOCK if the clock is not set"""
+        result = self.__request(
+            "read_clocks",
+            wait=self._timeout + timeout,
+            device_ids=[device.device_id for device in devices],
+            timeout=timeout,
+        )
+        clocks = {}
+        for device in devices:
+            clock = result.get(device.device_id)
+            if clock is None:
+                continue
+            clock = datetime.datetime.fromisoformat(clock)
+            if clock == INVALID_CLOCK:
+                clock = INVALID_CLOCK
+            device._rtc = (clock, time.monotonic())
+            clocks[device.device_id] = clock
+        return clocks
+
+    def sync_clocks(
+        self, devices: list, tolerance: float = 30, timeout: float = 4
+    ) -> list:
+        """Set the real time clock of the devices that are more than
+        tolerance seconds off the local time of the gateway.
+        Returns the ids of the devices that have been set"""
+        return self.__request(
+            "sync_clocks",
+            wait=self._timeout + timeout,
+            device_ids=[device.device_id for device in devices],
+            tolerance=tolerance,
+            timeout=timeout,
+        )
+
+    def validate_device(
+        self, device_id: str, password: str = None, ip_address: str = "<broadcast>"
+    ) -> Device:
+        """Validate if a device exist and repsonds.
+        Returns None if the device does not exist
+        Returns the Device object if it exist
+        """
+        device: Device = self.get_device(device_id)
+        if device is not None:
+            return device
+        state = self.__request(
+            "validate_device",
+            device_id=device_id,
+            password=password,
+            ip_address=ip_address,
+        )
+        if state is None:
+            return None
+        device = Device(device_id, password, ip_address)
+        self.update_device(device, state)
+        return device
+
+    def validate_devices(
+        self, entries, concurrency: int = 32, timeout: float = 4
+    ) -> dict:
+        """Validate if several devices exist and respond, at the same time.
+        Returns a ValidationResult by device id"""
+        results = self.__request(
+            "validate_devices",
+            wait=self._timeout + timeout,
+            entries=[[entry] if isinstance(entry, str) else entry for entry in entries],
+            concurrency=concurrency,
+            timeout=timeout,
+        )
+        return {
+            device_id: ValidationResult(**result)
+            for device_id, result in results.items()
+        }
+
+    def update_device(self, device: Device, state: dict) -> Change:
+        """Update the device with a state received from the gateway.
+        Returns the fields that have changed
+        """
+        state = dict(state)
+        del state["device_id"]
+        current: DeviceState = device._state
+        device._state = DeviceState(**state)
+        return changed_fields(current, device._state)
+
+    def __request(self, cmd: str, wait: float = None, **args):
+        """Send a request to the gateway and wait for the response.
+        Wait for wait seconds, or the timeout of the client"""
+        requestid = next(self._requestids)
+        event = threading.Event()
+        response = {}
+        with self._mutex:
+            self._pending[requestid] = (event, response)
+            send_message(self._sock, {"id": requestid, "cmd": cmd, "args": args})
+        try:
+            if not event.wait(self._timeout if wait is None else wait):
+                raise Exception("Timeout waiting for the gateway")
+        finally:
+            with self._mutex:
+                self._pending.pop(requestid, None)
+        if "error" in response:
+            raise Exception(response["error"])
+        return response.get("result")
+
+    def __receive_fn(self):
+        """Receive thread handling responses and events from the gateway"""
+        try:
+            while True:
+                message = receive_message(self._sock)
+                if message is None:
+                    return
+                if "event" in message:
+                    self._events.put(message)
+                    continue
+                with self._mutex:
+                    pending = self._pending.get(message.get("id"))
+                if pending is not None:
+                    event, response = pending
+                    response.update(message)
+                    event.set()
+        except (OSError, ValueError):
+            return
+
+    def __event_fn(self):
+        """Event thread calling the callbacks for the events in order"""
+        while True:
+            message = self._events.get()
+            if message is None:
+                return
+            self.__handle_event(message)
+
+    def __handle_event(self, message: dict):
+        if message["event"] == "found":
+            if self._found_device_callback is not None:
+                self._found_device_callback(message["device_id"])
+            return
+        state = message["device"]
+        device: Device = self.get_device(state["device_id"])
+        if device is None:
+            return
+        changes = self.update_device(device, state)
+        if changes:
+            device.notify_change(changes)
@@ -0,0 +1,214 @@
+"""Implements a journal recording the state changes of the devices"""
+import collections
+import json
+import sqlite3
+import threading
+from typing import NamedTuple
+
+from .change import Change
+from .device import DeviceState, PACKET_FIELDS
+
+# The fields of the state that are journaled and their change flags
+_FIELDS = (("ip_address", Change.IP_ADDRESS),) + PACKET_FIELDS
+
+
+class JournalRecord(NamedTuple):
+    """A change of the state of a device. A checkpoint has the values of all
+    the journaled fields, changed or not"""
+
+    timestamp: float
+    device_id: str
+    changes: Change
+    values: dict
+    checkpoint: bool = False
+
+
+class Journal:
+    """Appends the state changes of the devices to a sqlite database.
+
+    Pass a Journal to the DukaClient to record the changed fields of each
+    update. The records are queued and written by a background thread, so
+    the notify thread is not blocked by the disk. The records are committed
+    in batches of batch_size, or every flush_interval seconds. With fsync
+    the database is synced to disk on every commit.
+    The fan rpm changes all the time, so it is only recorded when included
+    in changes.
+    The first change of a device, and the first change after
+    checkpoint_interval seconds, is recorded as a checkpoint with all the
+    journaled fields, so state_at only reads back to the newest checkpoint.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        changes: Change = Change.ALL & ~Change.FAN1RPM,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        fsync: bool = False,
+        checkpoint_interval: float = 3600,
+    ):
+        self._path = path
+        self._mask = int(changes)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._fsync = fsync
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoints = {}
+        self._queue = collections.deque()
+        self._wakeup = threading.Event()
+        self.__open().close()
+        self._running = True
+        self._thread = threading.Thread(target=self.__writer_fn, daemon=True)
+        self._thread.start()
+
+    def record(
+        self,
+        timestamp: float,
+        device_id: str,
+        mask: int,
+        values: dict,
+        state: DeviceState,
+    ):
+        """Queue the changed values of a device, or a checkpoint with the
+        state when one is due. Called by the DukaClient"""
+        mask &= self._mask
+        if not mask:
+            return
+        checkpoint = self._checkpoints.get(device_id)
+        if checkpoint is None or timestamp - checkpoint >= self._checkpoint_interval:
+            self._checkpoints[device_id] = timestamp
+            self._queue.append((timestamp, device_id, self._mask, state, True))
+        else:
+            self._queue.append((timestamp, device_id, mask, values, False))
+        if len(self._queue) >= self._batch_size:
+            self._wakeup.set()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until the queued records have been committed.
+        Returns False on timeout"""
+        written = threading.Event()
+        self._queue.append(written)
+        self._wakeup.set()
+        return written.wait(timeout)
+
+    def close(self):
+        """Write the queued records and stop the writer thread"""
+        self._running = False
+        self._wakeup.set()
+        self._thread.join()
+
+    def state_at(self, device_id: str, timestamp: float) -> DeviceState:
+        """Return the state of a device at a time, from the records up to
+        that time. The records are read back to the newest checkpoint.
+        Returns None if there are no records"""
+        values = {}
+        missing = self._mask
+        connection = self.__open()
+        try:
+            cursor = connection.execute(
+                "SELECT mask, changed, checkpoint FROM changes"
+                " WHERE device_id = ? AND timestamp <= ?"
+                " ORDER BY timestamp DESC, id DESC",
+                (device_id, timestamp),
+            )
+            for mask, changed, checkpoint in cursor:
+                if mask & missing:
+                    changed = json.loads(changed)
+                    for name, flag in _FIELDS:
+                        if mask & missing & flag:
+                            values[name] = changed[name]
+                    missing &= ~mask
+                if checkpoint or not missing:
+                    break
+        finally:
+            connection.close()
+        if not values:
+            return None
+        return DeviceState(**values)
+
+    def scan(self, start: float, end: float, device_id: str = None) -> list:
+        """Return the records from start up to end, optionally only for one
+        device, ordered by time"""
+        query = "SELECT timestamp, device_id, mask, changed, checkpoint FROM changes"
+        query += " WHERE timestamp >= ? AND timestamp < ?"
+        args = (start, end)
+        if device_id is not None:
+            query += " AND device_id = ?"
+            args += (device_id,)
+        query += " ORDER BY timestamp, id"
+        connection = self.__open()
+        try:
+            return [
+                JournalRecord(
+                    row[0], row[1], Change(row[2]), json.loads(row[3]), bool(row[4])
+                )
+                for row in connection.execute(query, args)
+            ]
+        finally:
+            connection.close()
+
+    def __open(self) -> sqlite3.Connection:
+        """Open the database and create the table if it does not exist"""
+        connection = sqlite3.connect(self._path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "PRAGMA synchronous=" + ("FULL" if self._fsync else "NORMAL")
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY,"
+            " timestamp REAL, device_id TEXT, mask INTEGER, changed TEXT,"
+            " checkpoint INTEGER)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS changes_device"
+            " ON changes (device_id, timestamp)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS changes_time ON changes (timestamp)"
+        )
+        return connection
+
+    def __writer_fn(self):
+        """Writer thread committing the queued records in batches"""
+        connection = self.__open()
+        try:
+            while True:
+                running = self._running
+                self.__write_batches(connection)
+                if not running:
+                    return
+                self._wakeup.wait(self._flush_interval)
+                self._wakeup.clear()
+        finally:
+            connection.close()
+
+    def __write_batches(self, connection: sqlite3.Connection):
+        """Write the queued records, batch_size records in each commit"""
+        queue = self._queue
+        while queue:
+            rows = []
+            flushed = []
+            while queue and len(rows) < self._batch_size:
+                item = queue.popleft()
+                if isinstance(item, threading.Event):
+                    # a flush is waiting for the records before it
+                    flushed.append(item)
+                    continue
+                timestamp, device_id, mask, values, checkpoint = item
+                if checkpoint:
+                    values = values._asdict()
+                changed = {
+                    name: values[name] for name, flag in _FIELDS if mask & flag
+                }
+                changed = json.dumps(changed, separators=(",", ":"))
+                rows.append((timestamp, device_id, mask, changed, checkpoint))
+            if rows:
+                with connection:
+                    connection.executemany(
+                        "INSERT INTO changes"
+                        " (timestamp, device_id, mask, changed, checkpoint)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        rows,
+                    )
+            for written in flushed:
+                written.set()
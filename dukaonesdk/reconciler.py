@@ -0,0 +1,342 @@
+"""Implements a reconciler keeping the devices in a desired state"""
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+from .change import Change
+from .device import Device, Mode, Speed
+from .dukaclient import DukaClient
+from .dukapacket import DukaPacket
+from .schedule import Schedule
+from .shardedclient import ShardedDukaClient
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DesiredState(NamedTuple):
+    """The desired state of a device. Fields that are None are not managed"""
+
+    speed: Speed = None
+    manualspeed: int = None
+    mode: Mode = None
+    schedule: Schedule = None
+    weekly_schedule: bool = None
+
+
+class _RateLimit:
+    """A token bucket limiting the corrections sent to one device"""
+
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: int):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def ready(self, burst: int, interval: float) -> bool:
+        """Return True if there is a token. A token is added every interval"""
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated) / interval)
+        self.updated = now
+        return self.tokens >= 1
+
+    def spend(self):
+        """Spend a token on a correction that has been sent"""
+        self.tokens = max(self.tokens - 1, 0.0)
+
+
+class Reconciler:
+    """Keeps devices in a desired state.
+
+    The desired state is set for single devices or for groups of devices.
+    Each pass compares the desired state with the state the client has polled
+    from the devices, and sends the changed parameters in one frame per
+    device. Devices where the compared fields have not been received within
+    max_age seconds are skipped, and a device is not corrected again until
+    the fields have been received after the last correction. This makes the
+    devices converge again after a reboot or a manual change.
+
+    Each device may be corrected burst times in a row, and then once every
+    correction_interval seconds, so a device that keeps changing can not
+    flood the network. The schedule is compared every schedule_interval
+    seconds, as it takes several frames to read. The schedules of all the
+    devices due are read and written at the same time.
+    Errors are logged, and do not stop the other devices from being
+    reconciled.
+
+    The client must be a DukaClient or a ShardedDukaClient. The GatewayClient
+    does not know when the fields of a device were received; run the
+    reconciler in the gateway process instead.
+    """
+
+    def __init__(
+        self,
+        client,
+        interval: float = 5,
+        max_age: float = 5,
+        burst: int = 3,
+        correction_interval: float = 60,
+        schedule_interval: float = 3600,
+    ):
+        if not isinstance(client, (DukaClient, ShardedDukaClient)):
+            raise ValueError(
+                f"The reconciler can not use a {type(client).__name__}, "
+                "use a DukaClient or a ShardedDukaClient"
+            )
+        self._client = client
+        self._interval = interval
+        self._max_age = max_age
+        self._burst = burst
+        self._correction_interval = correction_interval
+        self._schedule_interval = schedule_interval
+        self._mutex = threading.Lock()
+        self._desired = {}
+        self._groups = {}
+        self._corrected = {}
+        self._schedule_checked = {}
+        self._ratelimits = {}
+        self._running = False
+        self._thread = None
+
+    def set_desired(self, device: Device, desired: DesiredState):
+        """Set the desired state of a device. The fields that are not None
+        override the desired state of the groups of the device.
+        Raises ValueError or UnsupportedCommandError if the device does not
+        support the desired state"""
+        self.__check(device, desired)
+        with self._mutex:
+            self._desired[device.device_id] = (device, desired)
+            self._schedule_checked.pop(device.device_id, None)
+
+    def clear_desired(self, device: Device):
+        """Stop managing the desired state of a device"""
+        with self._mutex:
+            self._desired.pop(device.device_id, None)
+
+    def set_group(self, name: str, devices: list, desired: DesiredState):
+        """Set the devices and the desired state of a group.
+        Raises ValueError or UnsupportedCommandError if a device does not
+        support the desired state"""
+        devices = list(devices)
+        for device in devices:
+            self.__check(device, desired)
+        with self._mutex:
+            self._groups[name] = (devices, desired)
+            self._schedule_checked = {}
+
+    def remove_group(self, name: str):
+        """Stop managing the desired state of a group"""
+        with self._mutex:
+            self._groups.pop(name, None)
+
+    def start(self):
+        """Start reconciling in a background thread"""
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self.__run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and wait for it to end"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reconcile(self) -> int:
+        """Compare the desired state with the state of the devices and send
+        the commands needed. Returns the number of devices corrected"""
+        corrected = set()
+        schedules = []
+        for device, desired in self.__desired_states():
+            try:
+                if self.__reconcile_device(device, desired, schedules):
+                    corrected.add(device.device_id)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Reconciling device %s failed", device.device_id)
+        corrected.update(self.__reconcile_schedules(schedules))
+        return len(corrected)
+
+    def __run(self):
+        while self._running:
+            self.reconcile()
+            timeout = time.monotonic() + self._interval
+            while self._running and time.monotonic() < timeout:
+                time.sleep(0.1)
+
+    def __desired_states(self) -> list:
+        """Return the devices and their desired state, merged from the groups
+        and the device"""
+        states = {}
+        with self._mutex:
+            for devices, desired in self._groups.values():
+                for device in devices:
+                    states[device.device_id] = self.__merge(
+                        states.get(device.device_id), device, desired
+                    )
+            for device, desired in self._desired.values():
+                states[device.device_id] = self.__merge(
+                    states.get(device.device_id), device, desired
+                )
+        return list(states.values())
+
+    def __merge(self, current: tuple, device: Device, desired: DesiredState):
+        if current is None:
+            return (device, desired)
+        changes = {k: v for k, v in desired._asdict().items() if v is not None}
+        return (device, current[1]._replace(**changes))
+
+    def __check(self, device: Device, desired: DesiredState):
+        """Check that the device supports the desired state"""
+        capabilities = device.capabilities
+        device_id = device.device_id
+        parameters = DukaPacket.Parameters
+        if desired.speed == Speed.OFF:
+            capabilities.check(device_id, parameters.ON_OFF.value)
+        elif desired.speed is not None:
+            capabilities.check(device_id, parameters.SPEED.value, desired.speed)
+        if desired.manualspeed is not None:
+            capabilities.check(
+                device_id, parameters.MANUAL_SPEED.value, desired.manualspeed
+            )
+        if desired.mode is not None:
+            capabilities.check(
+                device_id, parameters.VENTILATION_MODE.value, desired.mode
+            )
+        if desired.schedule is not None:
+            capabilities.check(device_id, parameters.SCHEDULE_SETUP.value)
+        if desired.weekly_schedule is not None:
+            capabilities.check(device_id, parameters.WEEKLY_SCHEDULE.value)
+
+    def __ratelimit(self, device: Device) -> _RateLimit:
+        ratelimit = self._ratelimits.get(device.device_id)
+        if ratelimit is None:
+            ratelimit = self._ratelimits[device.device_id] = _RateLimit(self._burst)
+        return ratelimit
+
+    def __reconcile_device(
+        self, device: Device, desired: DesiredState, schedules: list
+    ) -> bool:
+        """Send the parameters needed for one device, and add it to the
+        schedules if its schedule is due to be checked.
+        Returns True if a correction was sent"""
+        now = time.monotonic()
+        fields = self.__compared_fields(desired)
+        if fields:
+            seen = device.fields_seen(fields)
+        else:
+            seen = device.last_seen
+        if seen is None or now - seen > self._max_age:
+            # the state is stale, the device may be offline
+            return False
+        corrected = self._corrected.get(device.device_id)
+        if corrected is not None and seen <= corrected:
+            # wait for the state after the last correction
+            return False
+        ratelimit = self.__ratelimit(device)
+        if not ratelimit.ready(self._burst, self._correction_interval):
+            return False
+        if self.__schedule_due(device, desired, now):
+            schedules.append((device, desired))
+        parameters = self.__parameters(device, desired)
+        if not parameters:
+            return False
+        self._client.write_parameters(device, parameters)
+        ratelimit.spend()
+        self._corrected[device.device_id] = time.monotonic()
+        return True
+
+    def __compared_fields(self, desired: DesiredState) -> Change:
+        """Return the fields of the device compared with the desired state"""
+        fields = Change.NONE
+        if desired.speed is not None:
+            fields |= Change.SPEED
+        if desired.manualspeed is not None:
+            fields |= Change.MANUALSPEED
+        if desired.mode is not None:
+            fields |= Change.MODE
+        return fields
+
+    def __parameters(self, device: Device, desired: DesiredState) -> list:
+        """Return the (parameter, value) that differs from the desired state"""
+        parameters = []
+        state = device.state
+        if desired.speed is not None and state.speed != desired.speed:
+            if desired.speed == Speed.OFF:
+                parameters.append((DukaPacket.Parameters.ON_OFF.value, 0))
+            else:
+                if state.speed == Speed.OFF:
+                    parameters.append((DukaPacket.Parameters.ON_OFF.value, 1))
+                parameters.append((DukaPacket.Parameters.SPEED.value, desired.speed))
+        if (
+            desired.manualspeed is not None
+            and desired.speed in (None, Speed.MANUAL)
+            and state.manualspeed != desired.manualspeed
+        ):
+            parameters.append(
+                (DukaPacket.Parameters.MANUAL_SPEED.value, desired.manualspeed)
+            )
+        if desired.mode is not None and state.mode != desired.mode:
+            parameters.append(
+                (DukaPacket.Parameters.VENTILATION_MODE.value, desired.mode)
+            )
+        # the device can not be corrected for parameters it does not support
+        capabilities = device.capabilities
+        return [p for p in parameters if capabilities.supports(p[0])]
+
+    def __schedule_due(self, device: Device, desired: DesiredState, now) -> bool:
+        if desired.schedule is None and desired.weekly_schedule is None:
+            return False
+        parameter = DukaPacket.Parameters.SCHEDULE_SETUP.value
+        if not device.capabilities.supports(parameter):
+            return False
+        checked = self._schedule_checked.get(device.device_id)
+        return checked is None or now - checked > self._schedule_interval
+
+    def __reconcile_schedules(self, schedules: list) -> list:
+        """Write the periods of the schedules that differ, with one
+        write_schedules call for the devices with the same desired schedule,
+        and turn the weekly schedule on or off.
+        Returns the ids of the devices corrected"""
+        groups = []
+        checked = []
+        for device, desired in schedules:
+            if desired.schedule is None:
+                checked.append((device, desired, 0))
+                continue
+            for schedule, entries in groups:
+                if schedule == desired.schedule:
+                    entries.append((device, desired))
+                    break
+            else:
+                groups.append((desired.schedule, [(device, desired)]))
+        for schedule, entries in groups:
+            try:
+                written = self._client.write_schedules(
+                    [device for device, _ in entries], schedule
+                )
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Writing the schedules failed")
+                continue
+            for device, desired in entries:
+                # devices that do not respond are checked again next pass
+                if device.device_id in written:
+                    checked.append((device, desired, written[device.device_id]))
+        corrected = []
+        for device, desired, sent in checked:
+            try:
+                if (
+                    desired.weekly_schedule is not None
+                    and device.weekly_schedule != desired.weekly_schedule
+                ):
+                    self._client.set_weekly_schedule(device, desired.weekly_schedule)
+                    sent += 1
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Reconciling device %s failed", device.device_id)
+                continue
+            self._schedule_checked[device.device_id] = time.monotonic()
+            if sent:
+                self.__ratelimit(device).spend()
+                corrected.append(device.device_id)
+        return corrected
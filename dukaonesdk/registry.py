@@ -0,0 +1,62 @@
+"""Implements a copy-on-write registry of the devices"""
+import threading
+
+from .device import Device
+
+
+class DeviceRegistry:
+    """The devices of a client by device id.
+
+    The devices are kept in a dict that is never changed once published.
+    Readers use the current dict without locking, and iterating it is safe
+    while devices are added and removed, also without the GIL. Writers copy
+    the dict, change the copy and replace the published dict, protected by a
+    mutex so concurrent writers do not lose each others changes.
+    Adding and removing is O(n), which is fine as it is rare compared to
+    looking up the devices.
+    """
+
+    __slots__ = ("_view", "_mutex")
+
+    def __init__(self):
+        self._view = {}
+        self._mutex = threading.Lock()
+
+    def view(self) -> dict:
+        """Return the current devices by device id. The dict must not be
+        changed, and it is not updated by later changes to the registry"""
+        return self._view
+
+    def get(self, device_id: str) -> Device:
+        """Return a device, or None if it is not in the registry"""
+        return self._view.get(device_id)
+
+    def add(self, device: Device) -> Device:
+        """Add a device. If a device with the same id is already in the
+        registry, that device is returned and the registry is unchanged"""
+        with self._mutex:
+            current = self._view.get(device.device_id)
+            if current is not None:
+                return current
+            view = dict(self._view)
+            view[device.device_id] = device
+            self._view = view
+        return device
+
+    def remove(self, device_id: str) -> Device:
+        """Remove a device. Returns the device, or None if it is not in the
+        registry"""
+        with self._mutex:
+            device = self._view.get(device_id)
+            if device is None:
+                return None
+            view = dict(self._view)
+            del view[device_id]
+            self._view = view
+        return device
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._view
+
+    def __len__(self) -> int:
+        return len(self._view)
@@ -1,5 +1,9 @@
 """Implements a class for the UDP data packet"""
+import datetime
+
+from .device import INVALID_CLOCK
 from .mode import Mode
+from .schedule import SchedulePeriod
 from .speed import Speed
 from .dukapacket import DukaPacket
 
@@ -7,6 +11,28 @@ from .dukapacket import DukaPacket
 class ResponsePacket(DukaPacket):
     """A udp data packet from the duka device."""
 
+    __slots__ = (
+        "device_id",
+        "device_password",
+        "is_on",
+        "speed",
+        "manualspeed",
+        "fan1rpm",
+        "humidity",
+        "mode",
+        "filter_alarm",
+        "filter_timer",
+        "search_device_id",
+        "firmware_version",
+        "firmware_date",
+        "unit_type",
+        "weekly_schedule",
+        "schedule_periods",
+        "rtc",
+        "unsupported",
+        "fan1rpm_pos",
+    )
+
     parameter_size = {
         0x01: 1,  # On off
         0x02: 1,  # Speed 1-3 255=manual
@@ -69,6 +95,11 @@ class ResponsePacket(DukaPacket):
         self.firmware_version = None
         self.firmware_date = None
         self.unit_type = None
+        self.weekly_schedule = None
+        self.schedule_periods = None
+        self.rtc = None
+        self.unsupported = None
+        self.fan1rpm_pos = None
 
     def initialize_from_data(self, data) -> bool:
         """Initialize a packet from data revieved from the device
@@ -114,6 +145,12 @@ class ResponsePacket(DukaPacket):
         while self._pos < len(self._data) - 3:
             parameter = self.read_byte()
             size = 1
+            if parameter == 0xFD:
+                # the parameter is not supported by the device
+                if self.unsupported is None:
+                    self.unsupported = []
+                self.unsupported.append(self.read_byte())
+                continue
             if parameter == 0xFE:
                 # change parameter size
                 size = self.read_byte()
@@ -129,6 +166,7 @@ class ResponsePacket(DukaPacket):
             elif parameter == self.Parameters.MANUAL_SPEED.value:
                 self.manualspeed = self._data[self._pos]
             elif parameter == self.Parameters.FAN1RPM.value:
+                self.fan1rpm_pos = self._pos
                 self.fan1rpm = self._data[self._pos] + (self._data[self._pos + 1] << 8)
             elif parameter == self.Parameters.CURRENT_HUMIDITY.value:
                 self.humidity = self._data[self._pos]
@@ -151,6 +189,18 @@ class ResponsePacket(DukaPacket):
                     self._data[self._pos]
                     + (self._data[self._pos + 2] * 24 + self._data[self._pos + 1]) * 60
                 )
+            elif parameter == self.Parameters.WEEKLY_SCHEDULE.value:
+                self.weekly_schedule = self._data[self._pos] != 0
+            elif parameter == self.Parameters.SCHEDULE_SETUP.value:
+                if self.schedule_periods is None:
+                    self.schedule_periods = []
+                self.schedule_periods.append(
+                    SchedulePeriod.from_bytes(self._data[self._pos : self._pos + 6])
+                )
+            elif parameter == self.Parameters.RTC_TIME.value:
+                self.rtc = self.__read_rtc_time(self.rtc)
+            elif parameter == self.Parameters.RTC_CALENDAR.value:
+                self.rtc = self.__read_rtc_calendar(self.rtc)
             elif parameter == self.Parameters.SEARCH.value:
                 self.search_device_id = ""
                 for i in range(self._pos, self._pos + 16):
@@ -160,3 +210,36 @@ class ResponsePacket(DukaPacket):
             self.speed = Speed.OFF
 
         return True
+
+    def __read_rtc_time(self, rtc: datetime.datetime) -> datetime.datetime:
+        """Read the RTC time: seconds, minutes and hours.
+        Returns INVALID_CLOCK if the time is not valid"""
+        if rtc is None:
+            rtc = datetime.datetime(2000, 1, 1)
+        if rtc is INVALID_CLOCK:
+            return rtc
+        try:
+            return rtc.replace(
+                hour=self._data[self._pos + 2],
+                minute=self._data[self._pos + 1],
+                second=self._data[self._pos],
+            )
+        except ValueError:
+            return INVALID_CLOCK
+
+    def __read_rtc_calendar(self, rtc: datetime.datetime) -> datetime.datetime:
+        """Read the RTC calendar: day, day of week, month and year - 2000.
+        Returns INVALID_CLOCK if the date is not valid, e.g. day 0 when the
+        clock has not been set"""
+        if rtc is None:
+            rtc = datetime.datetime(2000, 1, 1)
+        if rtc is INVALID_CLOCK:
+            return rtc
+        try:
+            return rtc.replace(
+                year=2000 + self._data[self._pos + 3],
+                month=self._data[self._pos + 2],
+                day=self._data[self._pos],
+            )
+        except ValueError:
+            return INVALID_CLOCK
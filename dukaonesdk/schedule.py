@@ -0,0 +1,100 @@
+"""Implements the weekly schedule of the duka one device"""
+from typing import NamedTuple
+
+from .speed import Speed
+
+
+class SchedulePeriod(NamedTuple):
+    """A period of the weekly schedule.
+
+    The day is 0=Monday to 6=Sunday. Each day has 4 periods numbered 1-4.
+    A period runs with the speed until the end time, where the next period
+    starts.
+    """
+
+    day: int
+    period: int
+    speed: Speed
+    end_hour: int
+    end_minute: int
+
+    def to_bytes(self) -> bytes:
+        """Return the 6 bytes of the schedule setup parameter"""
+        return bytes(
+            [self.day, self.period, self.speed, 0, self.end_minute, self.end_hour]
+        )
+
+    @classmethod
+    def from_bytes(cls, data) -> "SchedulePeriod":
+        """Create a period from the 6 bytes of the schedule setup parameter"""
+        return cls(data[0], data[1], data[2], data[5], data[4])
+
+
+class Schedule:
+    """A weekly schedule with 4 periods for each day of the week"""
+
+    DAYS = 7
+    PERIODS = 4
+
+    def __init__(self, periods=()):
+        self._periods = {}
+        for period in periods:
+            self.set_period(period)
+
+    @classmethod
+    def every_day(cls, periods) -> "Schedule":
+        """Create a schedule with the same periods every day. The periods
+        are (speed, end_hour, end_minute) tuples for period 1-4"""
+        schedule = cls()
+        for day in range(cls.DAYS):
+            for number, (speed, end_hour, end_minute) in enumerate(periods, 1):
+                schedule.set_period(
+                    SchedulePeriod(day, number, speed, end_hour, end_minute)
+                )
+        return schedule
+
+    @classmethod
+    def keys(cls) -> list:
+        """Return the (day, period) of all the periods of a week"""
+        return [
+            (day, period)
+            for day in range(cls.DAYS)
+            for period in range(1, cls.PERIODS + 1)
+        ]
+
+    def set_period(self, period: SchedulePeriod):
+        """Set a period of the schedule"""
+        if not 0 <= period.day < self.DAYS:
+            raise ValueError(f"Invalid day {period.day}")
+        if not 1 <= period.period <= self.PERIODS:
+            raise ValueError(f"Invalid period number {period.period}")
+        if not (0 <= period.end_hour < 24 and 0 <= period.end_minute < 60):
+            raise ValueError(f"Invalid end time {period.end_hour}:{period.end_minute}")
+        self._periods[(period.day, period.period)] = period
+
+    def get_period(self, day: int, period: int) -> SchedulePeriod:
+        """Return a period, or None if it is not in the schedule"""
+        return self._periods.get((day, period))
+
+    def periods(self) -> list:
+        """Return the periods ordered by day and period number"""
+        return [self._periods[key] for key in sorted(self._periods)]
+
+    def is_complete(self) -> bool:
+        """Return True if all periods of the week are in the schedule"""
+        return len(self._periods) == self.DAYS * self.PERIODS
+
+    def diff(self, desired: "Schedule") -> list:
+        """Return the periods of the desired schedule that differ from this
+        schedule"""
+        return [
+            period
+            for period in desired.periods()
+            if self._periods.get((period.day, period.period)) != period
+        ]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Schedule) and self._periods == other._periods
+
+    def __len__(self) -> int:
+        return len(self._periods)
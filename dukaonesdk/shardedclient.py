@@ -0,0 +1,259 @@
+"""Implements a client that spreads the devices over several DukaClients"""
+import threading
+import zlib
+
+from .device import Device, Mode, Speed
+from .dukaclient import DukaClient
+from .journal import Journal
+from .schedule import Schedule
+from .tracing import Tracer
+
+
+class ShardedDukaClient:
+    """Client object for large fleets of duka devices.
+
+    The devices are split over a number of DukaClient shards. Each shard has
+    its own socket bound to an ephemeral port, its own receive buffer and
+    notify thread, and paces its own polls, so more shards poll more devices
+    a second. The decoding of the responses still shares the GIL.
+    A device always belongs to the same shard, selected from its device id.
+    """
+
+    def __init__(
+        self, shards: int = 4, tracer: Tracer = None, journal: Journal = None
+    ):
+        if shards < 1:
+            raise ValueError("There must be at least one shard")
+        self._shards = [
+            DukaClient(port=0, tracer=tracer, journal=journal) for _ in range(shards)
+        ]
+
+    @property
+    def shards(self) -> list:
+        """Return the DukaClient shards"""
+        return self._shards
+
+    def close(self):
+        """Close all the shards and wait for the notify threads to end"""
+        for shard in self._shards:
+            shard.close()
+
+    def get_shard(self, device_id: str) -> DukaClient:
+        """Return the shard handling the device with the specified id"""
+        index = zlib.crc32(device_id.encode()) % len(self._shards)
+        return self._shards[index]
+
+    def add_device(
+        self,
+        device_id: str,
+        password: str = None,
+        ip_address: str = "<broadcast>",
+        onchange=None,
+    ) -> Device:
+        """Add a new device. If the device already exist the current one will
+        be returned"""
+        return self.get_shard(device_id).add_device(
+            device_id, password, ip_address, onchange
+        )
+
+    def remove_device(self, device_id):
+        """Remove an existing device"""
+        return self.get_shard(device_id).remove_device(device_id)
+
+    def get_device(self, device_id: str) -> Device:
+        """Get a device by device id."""
+        return self.get_shard(device_id).get_device(device_id)
+
+    def get_device_count(self):
+        """Return the number of devices"""
+        return sum(shard.get_device_count() for shard in self._shards)
+
+    def stats(self) -> dict:
+        """Return the frame counters summed over the shards"""
+        stats = [shard.stats() for shard in self._shards]
+        received = sum(s["frames_received"] for s in stats)
+        identical = sum(s["frames_identical"] for s in stats)
+        rpm_only = sum(s["frames_rpm_only"] for s in stats)
+        return {
+            "frames_received": received,
+            "frames_identical": identical,
+            "frames_rpm_only": rpm_only,
+            "hit_rate": (identical + rpm_only) / received if received else 0.0,
+        }
+
+    def snapshot(self) -> dict:
+        """Return the current state of every device by device id"""
+        states = {}
+        for shard in self._shards:
+            states.update(shard.snapshot())
+        return states
+
+    def set_poll_interval(self, device: Device, parameter: int, seconds: float):
+        """Set the number of seconds between reading a status parameter of the
+        device. Use None to stop reading the parameter"""
+        self.get_shard(device.device_id).set_poll_interval(device, parameter, seconds)
+
+    def request_status(self, devices: list):
+        """Send a status read to the devices now"""
+        for shard, group in self.__group_by_shard(devices):
+            shard.request_status(group)
+
+    def search_devices(self, callback):
+        """Search for devices. The search is done by the first shard"""
+        self._shards[0].search_devices(callback)
+
+    def set_speed(self, device: Device, speed: Speed):
+        """Set the speed of the specified device"""
+        self.get_shard(device.device_id).set_speed(device, speed)
+
+    def set_manual_speed(self, device: Device, manualspeed: int):
+        """Set the manual speed of the specified device"""
+        self.get_shard(device.device_id).set_manual_speed(device, manualspeed)
+
+    def turn_off(self, device: Device):
+        """Turn off the specified device"""
+        self.get_shard(device.device_id).turn_off(device)
+
+    def turn_on(self, device: Device):
+        """Turn on the specified device"""
+        self.get_shard(device.device_id).turn_on(device)
+
+    def set_mode(self, device: Device, mode: Mode):
+        """Set the mode of the specified device"""
+        self.get_shard(device.device_id).set_mode(device, mode)
+
+    def reset_filter_alarm(self, device: Device):
+        """Reset the filter alarm"""
+        self.get_shard(device.device_id).reset_filter_alarm(device)
+
+    def write_parameters(self, device: Device, parameters: list):
+        """Write several (parameter, value) to the device in one frame"""
+        self.get_shard(device.device_id).write_parameters(device, parameters)
+
+    def set_weekly_schedule(self, device: Device, enabled: bool):
+        """Turn the weekly schedule of the device on or off"""
+        self.get_shard(device.device_id).set_weekly_schedule(device, enabled)
+
+    def read_schedule(self, device: Device, timeout: float = 4) -> Schedule:
+        """Read the weekly schedule of the device.
+        Returns None if the device does not respond"""
+        return self.get_shard(device.device_id).read_schedule(device, timeout)
+
+    def write_schedule(
+        self, device: Device, desired: Schedule, timeout: float = 4
+    ) -> int:
+        """Write the periods of the desired schedule that differ to the
+        device. Returns the number of periods written, or None if the device
+        does not respond"""
+        return self.get_shard(device.device_id).write_schedule(
+            device, desired, timeout
+        )
+
+    def read_schedules(self, devices: list, timeout: float = 4) -> dict:
+        """Read the weekly schedule of several devices.
+        Returns the Schedule by device id of the devices that responded"""
+        result = {}
+        for schedules in self.__in_parallel(
+            self.__group_by_shard(devices),
+            lambda shard, group: shard.read_schedules(group, timeout),
+        ):
+            result.update(schedules)
+        return result
+
+    def write_schedules(
+        self, devices: list, desired: Schedule, timeout: float = 4
+    ) -> dict:
+        """Write the desired schedule to several devices.
+        Returns the number of periods written by device id"""
+        result = {}
+        for written in self.__in_parallel(
+            self.__group_by_shard(devices),
+            lambda shard, group: shard.write_schedules(group, desired, timeout),
+        ):
+            result.update(written)
+        return result
+
+    def read_clocks(self, devices: list, timeout: float = 4) -> dict:
+        """Read the real time clock of several devices.
+        Returns the current time of the clock by device id"""
+        result = {}
+        for clocks in self.__in_parallel(
+            self.__group_by_shard(devices),
+            lambda shard, group: shard.read_clocks(group, timeout),
+        ):
+            result.update(clocks)
+        return result
+
+    def sync_clocks(
+        self, devices: list, tolerance: float = 30, timeout: float = 4
+    ) -> list:
+        """Set the real time clock of the devices that are more than
+        tolerance seconds off. Returns the ids of the devices that were set"""
+        result = []
+        for synced in self.__in_parallel(
+            self.__group_by_shard(devices),
+            lambda shard, group: shard.sync_clocks(group, tolerance, timeout),
+        ):
+            result += synced
+        return result
+
+    def __group_by_shard(self, devices: list) -> list:
+        """Return (shard, devices) for the shards handling the devices"""
+        groups = {}
+        for device in devices:
+            groups.setdefault(self.get_shard(device.device_id), []).append(device)
+        return list(groups.items())
+
+    def __in_parallel(self, groups: list, call) -> list:
+        """Call call(shard, group) for the (shard, group) pairs, each in its own
+        thread, so the shards wait for the devices at the same time.
+        Returns the results. Raises the first exception of the calls"""
+        results = [None] * len(groups)
+        errors = []
+
+        def run(index: int, shard: DukaClient, group: list):
+            try:
+                results[index] = call(shard, group)
+            except Exception as error:  # pylint: disable=broad-except
+                errors.append(error)
+
+        threads = [
+            threading.Thread(target=run, args=(index, shard, group))
+            for index, (shard, group) in enumerate(groups)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def validate_device(
+        self, device_id: str, password: str = None, ip_address: str = "<broadcast>"
+    ) -> Device:
+        """Validate if a device exist and repsonds.
+        Returns None if the device does not exist
+        Returns the Device object if it exist
+        """
+        return self.get_shard(device_id).validate_device(
+            device_id, password, ip_address
+        )
+
+    def validate_devices(
+        self, entries, concurrency: int = 32, timeout: float = 4
+    ) -> dict:
+        """Validate several devices at the same time. The shards validate
+        their devices in parallel.
+        Returns a ValidationResult by device id"""
+        groups = {}
+        for entry in entries:
+            device_id = entry if isinstance(entry, str) else entry[0]
+            groups.setdefault(self.get_shard(device_id), []).append(entry)
+        result = {}
+        for results in self.__in_parallel(
+            list(groups.items()),
+            lambda shard, group: shard.validate_devices(group, concurrency, timeout),
+        ):
+            result.update(results)
+        return result
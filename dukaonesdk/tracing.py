@@ -0,0 +1,210 @@
+"""Implements tracing of the lifecycle of the commands sent to the devices"""
+import json
+import threading
+import time
+
+from .dukapacket import DukaPacket
+
+
+class Tracer:
+    """Records the stages of each command sent to a device.
+
+    Pass a Tracer to the DukaClient to enable tracing. A command is traced
+    from the time it is requested until the response has been applied to the
+    device and the onchange callback is done. The commands are correlated
+    with the responses by device id, parameter and the value written, and
+    responses received before the command was sent are ignored.
+
+    The stages are:
+    enqueue, socket_ready, lock_acquired, sent, received, decoded, applied
+    and callback_done.
+
+    Use export_chrome_trace to save the trace in the Chrome trace event
+    format, which can be opened in chrome://tracing or ui.perfetto.dev.
+    """
+
+    # The response packet attribute for the parameters of the commands
+    _response_attributes = {
+        DukaPacket.Parameters.ON_OFF.value: "is_on",
+        DukaPacket.Parameters.SPEED.value: "speed",
+        DukaPacket.Parameters.MANUAL_SPEED.value: "manualspeed",
+        DukaPacket.Parameters.VENTILATION_MODE.value: "mode",
+    }
+
+    def __init__(self, max_commands: int = 100000):
+        self._mutex = threading.Lock()
+        self._origin = time.perf_counter()
+        self._max_commands = max_commands
+        self._commands = []
+        self._spans = []
+        self._pending = {}
+        self._finished = {}
+        self._values = {}
+        self._responses = {}
+        self._lanes = {}
+
+    def begin_command(self, device_id: str, parameter: int, name: str, value=None):
+        """Record that a command has been requested. The value is the value
+        written by the command. If it is None any response to the parameter
+        ends the command"""
+        key = (device_id, parameter)
+        with self._mutex:
+            if len(self._commands) >= self._max_commands:
+                return
+            command = (device_id, parameter, name, [("enqueue", self.__now())])
+            self._commands.append(command)
+            self._pending[key] = command
+            self._values[key] = value
+            self._responses.pop(key, None)
+
+    def stage(
+        self,
+        device_id: str,
+        parameter: int,
+        stage: str,
+        final: bool = False,
+        at: float = None,
+    ):
+        """Record a stage of a command. A final stage ends the command.
+        The time of the stage is now, or at if specified
+        (from time.perf_counter).
+        The response may be handled before the sender has recorded that the
+        command was sent, so a stage missing in an ended command is added
+        """
+        key = (device_id, parameter)
+        with self._mutex:
+            command = self._pending.get(key)
+            if command is None:
+                command = self._finished.get(key)
+                if command is None or any(s == stage for s, _ in command[3]):
+                    return
+            command[3].append((stage, self.__now() if at is None else at))
+            if final and key in self._pending:
+                del self._pending[key]
+                del self._values[key]
+                self._responses.pop(key, None)
+                self._finished[key] = command
+
+    def response_stage(
+        self,
+        device_id: str,
+        packet,
+        stage: str,
+        final: bool = False,
+        at: float = None,
+    ):
+        """Record a stage of all the commands answered by a response packet.
+        The first stage of a response decides which commands it answers, and
+        the later stages are only recorded for the same packet"""
+        if not self._pending:
+            return
+        for parameter, attribute in self._response_attributes.items():
+            value = getattr(packet, attribute)
+            if value is None:
+                continue
+            if self.__answers((device_id, parameter), packet, value, at):
+                self.stage(device_id, parameter, stage, final, at)
+
+    def span(self, device_id: str, name: str, start: float, end: float):
+        """Record a span that is not a stage of a command, like a sleep.
+        The times are from time.perf_counter"""
+        with self._mutex:
+            if len(self._spans) < self._max_commands:
+                self._spans.append((device_id, name, start, end))
+
+    def events(self) -> list:
+        """Return the recorded trace events. Commands that have not ended
+        are included up to their last stage"""
+        with self._mutex:
+            events = []
+            for device_id, name, start, end in self._spans:
+                events.append(
+                    self.__event(device_id, name, start, end, {"device_id": device_id})
+                )
+            for command in self._commands:
+                events += self.__command_events(*command)
+            for device_id, lane in self._lanes.items():
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": 1,
+                        "tid": lane,
+                        "args": {"name": device_id},
+                    }
+                )
+        return events
+
+    def export_chrome_trace(self, path: str):
+        """Save the trace as Chrome trace event JSON"""
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.events()}, file)
+
+    def clear(self):
+        """Remove all recorded events"""
+        with self._mutex:
+            self._commands = []
+            self._spans = []
+            self._pending = {}
+            self._finished = {}
+            self._values = {}
+            self._responses = {}
+
+    def __answers(self, key: tuple, packet, value, at: float) -> bool:
+        """Return True if the packet answers the pending command. It must
+        have the value written, and be received after the command was sent"""
+        with self._mutex:
+            command = self._pending.get(key)
+            if command is None:
+                return False
+            response = self._responses.get(key)
+            if response is not None:
+                return response is packet
+            expected = self._values[key]
+            if expected is not None and value != expected:
+                return False
+            sent = None
+            for stage, stage_at in command[3]:
+                if stage == "lock_acquired":
+                    sent = stage_at
+            if sent is None or (self.__now() if at is None else at) < sent:
+                return False
+            self._responses[key] = packet
+            return True
+
+    def __now(self) -> float:
+        return time.perf_counter()
+
+    def __lane(self, device_id: str) -> int:
+        """Return the trace thread id used for a device"""
+        lane = self._lanes.get(device_id)
+        if lane is None:
+            lane = len(self._lanes) + 1
+            self._lanes[device_id] = lane
+        return lane
+
+    def __event(
+        self, device_id: str, name: str, start: float, end: float, args: dict
+    ) -> dict:
+        """Return a complete trace event"""
+        return {
+            "name": name,
+            "ph": "X",
+            "ts": (start - self._origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": 1,
+            "tid": self.__lane(device_id),
+            "args": args,
+        }
+
+    def __command_events(
+        self, device_id: str, parameter: int, name: str, stages: list
+    ) -> list:
+        """Return a span for the command and a span for each stage, named by
+        the stage it ends in"""
+        args = {"device_id": device_id, "parameter": f"0x{parameter:02X}"}
+        stages = sorted(stages, key=lambda stage: stage[1])
+        events = [self.__event(device_id, name, stages[0][1], stages[-1][1], args)]
+        for (_, begin), (stage, end) in zip(stages, stages[1:]):
+            events.append(self.__event(device_id, stage, begin, end, args))
+        return events